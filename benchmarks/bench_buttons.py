@@ -0,0 +1,98 @@
+# Стоимость выбора обработчика для нажатия кнопки: прежняя цепочка фильтров
+# F.text == "..." (по одному обработчику на кнопку) против таблицы ButtonRouter.
+# Оба диспетчера построены из настоящих клавиатур main.py и имеют те же
+# обработчики состояний FSM перед кнопками; сами обработчики ничего не делают.
+# Запуск: python benchmarks/bench_buttons.py --messages 5000
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher, F  # noqa: E402
+from aiogram.filters.state import State, StatesGroup  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+from buttons import ButtonRouter  # noqa: E402
+
+
+def keyboard_texts():
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+    os.environ.setdefault("ADMIN_ID", "1")
+    os.environ.setdefault("CHANNEL_ID", "-1001")
+    os.environ.setdefault("METRICS_PORT", "0")
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="bench_buttons_"))  # bot.log пишется в текущий каталог
+    try:
+        import main
+    finally:
+        os.chdir(cwd)
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    texts = []
+    for keyboard in (main.menu_kb, main.stats_kb, main.favorites_kb, main.confirm_kb):
+        for row in keyboard.keyboard:
+            texts.extend(button.text for button in row if button.text not in texts)
+    states = sum(1 for handler in main.dp.message.handlers
+                 if any(isinstance(f.callback, State) for f in handler.filters or ()))
+    return texts, states
+
+
+async def noop(message):
+    return None
+
+
+def build(texts, states, use_router):
+    dp = Dispatcher()
+    form = type("Form", (StatesGroup,), {f"step{index}": State() for index in range(states)})
+    for state in form.__states__:
+        dp.message.register(noop, state)
+    if use_router:
+        router = ButtonRouter()
+        router.keyboard([texts])
+        for text in texts:
+            router.button(text)(noop)
+        router.register(dp.message)
+    else:
+        for text in texts:
+            dp.message.register(noop, F.text == text)
+    dp.message.register(noop)
+    return dp
+
+
+def message_update(update_id, text):
+    return Update.model_validate({"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "u"}, "text": text}})
+
+
+async def measure(dp, bot, texts, messages):
+    updates = [message_update(i, texts[i % len(texts)]) for i in range(messages)]
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / messages * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    args = parser.parse_args()
+
+    texts, states = keyboard_texts()
+    bot = Bot(token="123456:BENCHMARK")
+    print(f"кнопок: {len(texts)}, обработчиков состояний перед кнопками: {states}")
+    cases = {"первая кнопка": texts[:1], "последняя кнопка": texts[-1:], "все кнопки": texts,
+             "обычный текст": ["просто текст"]}
+    for name, case in cases.items():
+        chain = await measure(build(texts, states, use_router=False), bot, case, args.messages)
+        table = await measure(build(texts, states, use_router=True), bot, case, args.messages)
+        print(f"{name:>17}: цепочка {chain:7.1f} мкс, таблица {table:7.1f} мкс на сообщение")
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+# Бенчмарк слоя базы данных: обновлений в секунду до и после перехода на пул соединений.
+# Запуск: python benchmarks/bench_db.py --updates 2000 --concurrency 50
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS query_history
+         (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, username TEXT,
+          query_type TEXT, query_text TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS user_stats
+         (user_id INTEGER PRIMARY KEY, username TEXT, total_queries INTEGER DEFAULT 0,
+          wiki_queries INTEGER DEFAULT 0, translate_queries INTEGER DEFAULT 0,
+          last_active DATETIME DEFAULT CURRENT_TIMESTAMP);
+'''
+INSERT_HISTORY = 'INSERT INTO query_history (user_id, username, query_type, query_text) VALUES (?, ?, ?, ?)'
+UPSERT_STATS = '''INSERT OR REPLACE INTO user_stats
+             (user_id, username, total_queries, wiki_queries, translate_queries, last_active)
+             VALUES (?, ?, COALESCE((SELECT total_queries + 1 FROM user_stats WHERE user_id = ?), 1),
+                     COALESCE((SELECT wiki_queries + ? FROM user_stats WHERE user_id = ?), ?),
+                     COALESCE((SELECT translate_queries + ? FROM user_stats WHERE user_id = ?), ?),
+                     CURRENT_TIMESTAMP)'''
+SELECT_HISTORY = '''SELECT query_type, query_text, timestamp FROM query_history
+             WHERE user_id = ? ORDER BY timestamp DESC LIMIT 5'''
+
+
+def stats_params(user_id):
+    return (user_id, str(user_id), user_id, 1, user_id, 1, 0, user_id, 0)
+
+
+# Старая реализация: новое соединение на каждый вызов прямо в цикле событий
+def legacy_update(path, user_id):
+    for sql, params in ((INSERT_HISTORY, (user_id, str(user_id), "wiki", "Python")),
+                        (UPSERT_STATS, stats_params(user_id))):
+        conn = sqlite3.connect(path)
+        conn.execute(sql, params)
+        conn.commit()
+        conn.close()
+    conn = sqlite3.connect(path)
+    conn.execute(SELECT_HISTORY, (user_id,)).fetchall()
+    conn.close()
+
+
+async def run_legacy(path, updates, concurrency):
+    async def worker(offset):
+        for i in range(offset, updates, concurrency):
+            legacy_update(path, i % 1000)
+            await asyncio.sleep(0)
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+
+
+async def run_pooled(db, updates, concurrency):
+    async def worker(offset):
+        for i in range(offset, updates, concurrency):
+            user_id = i % 1000
+            await db.execute(INSERT_HISTORY, (user_id, str(user_id), "wiki", "Python"))
+            await db.execute(UPSERT_STATS, stats_params(user_id))
+            await db.fetchall(SELECT_HISTORY, (user_id,))
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+
+
+async def measure(name, coro_factory, updates):
+    started = time.perf_counter()
+    await coro_factory()
+    elapsed = time.perf_counter() - started
+    print(f"{name:>8}: {updates} обновлений за {elapsed:.2f} с -> {updates / elapsed:.0f} обн/с")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--readers", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        conn = sqlite3.connect(legacy_path)
+        conn.executescript(SCHEMA)
+        conn.close()
+        await measure("до", lambda: run_legacy(legacy_path, args.updates, args.concurrency), args.updates)
+
+        db = Database(os.path.join(tmp, "pooled.db"), readers=args.readers)
+        db.open()
+        await db.executescript(SCHEMA)
+        try:
+            await measure("после", lambda: run_pooled(db, args.updates, args.concurrency), args.updates)
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
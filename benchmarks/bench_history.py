@@ -0,0 +1,94 @@
+# Бенчмарк выборок истории, избранного и /popular на большой таблице query_history:
+# сначала схема v1 (без индексов и query_counts), затем после миграций.
+# Запуск: python benchmarks/bench_history.py --rows 2000000
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schema import MIGRATIONS  # noqa: E402
+
+QUERIES = {
+    "история пользователя (страница)": ('''SELECT id, query_type, query_text, timestamp FROM query_history
+                                           WHERE user_id = ? ORDER BY id DESC LIMIT 11''', "user"),
+    "избранное (страница)": ('''SELECT id, query_type, query_text, timestamp FROM favorites
+                                WHERE user_id = ? ORDER BY id DESC LIMIT 11''', "user"),
+    "удаление из избранного": ("DELETE FROM favorites WHERE user_id = ? AND query_text = ?", "user_text"),
+}
+POPULAR_OLD = '''SELECT query_text, COUNT(*) as count FROM query_history
+                 GROUP BY query_text ORDER BY count DESC LIMIT 5'''
+POPULAR_NEW = "SELECT query_text, count FROM query_counts ORDER BY count DESC LIMIT 5"
+
+
+def populate(conn, rows, users, vocabulary):
+    rnd = random.Random(42)
+    words = [f"запрос {i}" for i in range(vocabulary)]
+    weights = [1 / (i + 1) for i in range(vocabulary)]
+    batch = 100_000
+    for start in range(0, rows, batch):
+        size = min(batch, rows - start)
+        texts = rnd.choices(words, weights, k=size)
+        conn.executemany(
+            "INSERT INTO query_history (user_id, username, query_type, query_text, timestamp) VALUES (?, ?, ?, ?, ?)",
+            ((uid := rnd.randrange(users), str(uid), rnd.choice(("wiki", "translate")), text,
+              f"2026-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} 12:00:00") for text in texts))
+        conn.commit()
+    conn.executemany("INSERT INTO favorites (user_id, query_type, query_text) VALUES (?, 'general', ?)",
+                     ((rnd.randrange(users), rnd.choice(words)) for _ in range(rows // 20)))
+    conn.commit()
+
+
+def timed(conn, sql, params, repeat):
+    started = time.perf_counter()
+    for i in range(repeat):
+        conn.execute(sql, params(i)).fetchall()
+    conn.rollback()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def run(conn, popular_sql, users, repeat):
+    rnd = random.Random(7)
+    params = {"user": lambda i: (rnd.randrange(users),), "user_text": lambda i: (rnd.randrange(users), "нет такого")}
+    results = {name: timed(conn, sql, params[kind], repeat) for name, (sql, kind) in QUERIES.items()}
+    results["/popular"] = timed(conn, popular_sql, lambda i: (), max(1, repeat // 20))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--vocabulary", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "history.db"))
+        conn.executescript(MIGRATIONS[0])
+        started = time.perf_counter()
+        populate(conn, args.rows, args.users, args.vocabulary)
+        print(f"Заполнено {args.rows} строк истории за {time.perf_counter() - started:.1f} с")
+
+        before = run(conn, POPULAR_OLD, args.users, args.repeat)
+        started = time.perf_counter()
+        for migration in MIGRATIONS[1:]:
+            if callable(migration):
+                migration(conn)
+            else:
+                conn.executescript(migration)
+        print(f"Миграции применены за {time.perf_counter() - started:.1f} с")
+        after = run(conn, POPULAR_NEW, args.users, args.repeat)
+        conn.close()
+
+    print(f"{'выборка':<24}{'до, мс':>12}{'после, мс':>12}")
+    for name in before:
+        print(f"{name:<24}{before[name]:>12.3f}{after[name]:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+# Нагрузочный тест бота без сети: Bot API, Википедия, переводчик и курс валют
+# заменены локальными заглушками (stub_api.py) с настраиваемой задержкой.
+# Синтетические сессии пользователей (кнопки меню, FSM-сценарии вроде ComplaintForm,
+# команды администратора) подаются в диспетчер с заданной частотой; обновления
+# одного пользователя обрабатываются по порядку, как в боевом режиме.
+# Результат - JSON с пропускной способностью, задержками p50/p95/p99 по обновлениям
+# и обработчикам и ожиданием соединений базы; два файла можно сравнить через --compare.
+# Запуск: python benchmarks/bench_load.py --updates 3000 --rate 200 --output load.json
+#         python benchmarks/bench_load.py --compare old.json new.json
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_api import StubServer, StubWikiClient, StubTranslateBackend  # noqa: E402
+
+ADMIN_ID = 1
+TITLES = ["Python", "SQLite", "Telegram", "Ташкент", "Москва", "Linux", "Asyncio", "Эйнштейн",
+          "Нет такой статьи", "Нет и этой"] + [f"Статья {i}" for i in range(40)]
+PHRASES = ["Привет, как дела?", "Где находится вокзал?", "Спасибо большое", "Сколько это стоит?",
+           "Хорошего дня"] + [f"Фраза номер {i}" for i in range(20)]
+
+# Сценарии: (название, вес, шаги). Шаг - текст сообщения, ("callback", data)
+# или функция rng -> текст (случайный запрос).
+SCENARIOS = [
+    ("menu", 4, ["/start", "📅 Дата и время", "🎲 Случайное число", "💰 Курс валют", "📊 Моя статистика"]),
+    ("wiki", 3, ["🔎 Википедия", lambda rng: rng.choice(TITLES)]),
+    ("translate", 2, ["🈹 Переводчик", lambda rng: rng.choice(PHRASES)]),
+    ("complaint", 1, ["📑 Жалобы/Предложения", "Иван Иванов", "ivan@example.com",
+                      "Бот отвечает медленно", "✅ Подтвердить"]),
+    ("favorites", 1, ["➕ Добавить в избранное", lambda rng: rng.choice(TITLES), "⭐️ Избранное", "📜 История"]),
+    ("subscription", 1, [("callback", "check_subscription")]),
+]
+ADMIN_SCENARIO = ("admin", ["/admin_stats", "/popular", "/perf"])
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def make_update(update_id, user_id, step):
+    sender = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+    chat = {"id": user_id, "type": "private"}
+    if isinstance(step, tuple):
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": sender, "chat_instance": str(user_id), "data": step[1],
+            "message": {"message_id": update_id, "date": int(time.time()), "chat": chat, "text": "..."}}}
+    return {"update_id": update_id, "message": {"message_id": update_id, "date": int(time.time()),
+                                                "chat": chat, "from": sender, "text": step}}
+
+
+# Поток обновлений: у каждого пользователя своя текущая сессия, следующее
+# обновление берётся у случайного пользователя, поэтому сессии перемежаются
+def update_stream(count, users, admin_share, seed):
+    rng = random.Random(seed)
+    names = [scenario[0] for scenario in SCENARIOS]
+    weights = [scenario[1] for scenario in SCENARIOS]
+    steps = {scenario[0]: scenario[2] for scenario in SCENARIOS}
+    sessions = {}
+    for update_id in range(1, count + 1):
+        if rng.random() < admin_share:
+            user_id, name = ADMIN_ID, ADMIN_SCENARIO[0]
+            step = rng.choice(ADMIN_SCENARIO[1])
+        else:
+            user_id = 1000 + rng.randrange(users)
+            name, position = sessions.get(user_id) or (rng.choices(names, weights)[0], 0)
+            step = steps[name][position]
+            position += 1
+            sessions[user_id] = (name, position) if position < len(steps[name]) else None
+        if callable(step):
+            step = step(rng)
+        yield name, make_update(update_id, user_id, step)
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0, "p95": 0, "p99": 0, "max": 0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": round(values[-1] * 1000, 2)}
+
+
+async def run(args):
+    stub = StubServer(telegram_latency=args.telegram_latency_ms / 1000, wiki_latency=args.wiki_latency_ms / 1000,
+                      translate_latency=args.translate_latency_ms / 1000, rates_latency=args.rates_latency_ms / 1000,
+                      jitter=args.jitter_ms / 1000)
+    base_url = await stub.start()
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    os.environ.update({
+        "BOT_TOKEN": "123456:BENCHMARK", "ADMIN_ID": str(ADMIN_ID), "CHANNEL_ID": "-1001",
+        "CHANNEL_URL": "https://t.me/benchmark", "DB_PATH": os.path.join(workdir, "bot.db"),
+        "TELEGRAM_API_URL": base_url, "RATES_URL": base_url + "/rates", "METRICS_PORT": "0",
+    })
+    if not args.send_limits:
+        # Лимиты Bot API меряются отдельно (sender.py), здесь они только мешают
+        os.environ.update({"SEND_GLOBAL_RATE": "1000000", "SEND_CHAT_RATE": "1000000", "SEND_CHAT_BURST": "1000000"})
+    cwd = os.getcwd()
+    os.chdir(workdir)  # bot.log пишется в текущий каталог
+    try:
+        import main
+        from metrics import REGISTRY
+        from sharding import process_shard
+    finally:
+        os.chdir(cwd)
+    # Журнал каждого обновления в stdout заметно искажает замер
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    main.wiki_service.client = StubWikiClient(base_url)
+    translate_backend = main.translation_service.backend = StubTranslateBackend(base_url)
+    await main.start_services(resume_broadcasts=False, metrics_port=0, maintenance=False)
+
+    arrivals = {}
+    service_times = []
+    latencies = []
+    by_scenario = {}
+    errors = 0
+
+    async def feed(update):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            await main.dp.feed_raw_update(main.bot, update)
+        except Exception:
+            errors += 1
+            raise
+        finally:
+            finished = time.perf_counter()
+            name, arrived = arrivals.pop(update["update_id"])
+            service_times.append(finished - started)
+            latencies.append(finished - arrived)
+            by_scenario.setdefault(name, []).append(finished - arrived)
+
+    updates = queue.Queue()
+    worker = asyncio.create_task(process_shard(updates, feed))
+    started = time.perf_counter()
+    for index, (name, update) in enumerate(update_stream(args.updates, args.users, args.admin_share, args.seed)):
+        if args.rate:
+            delay = started + index / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        arrivals[update["update_id"]] = (name, time.perf_counter())
+        updates.put(update)
+    updates.put(None)
+    await worker
+    elapsed = time.perf_counter() - started
+
+    handlers = {}
+    for labels, histogram in REGISTRY.histogram_summary("bot_stage_seconds").items():
+        stage = labels[0][1]
+        handlers[stage] = {"count": histogram.count, "avg_ms": round(histogram.sum / histogram.count * 1000, 2),
+                           "p50_ms": round(histogram.quantile(0.5) * 1000, 2),
+                           "p95_ms": round(histogram.quantile(0.95) * 1000, 2),
+                           "p99_ms": round(histogram.quantile(0.99) * 1000, 2)}
+    result = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "updates": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_ups": round(len(latencies) / elapsed, 1),
+        "latency_ms": percentiles(latencies),
+        "service_ms": percentiles(service_times),
+        "scenarios_ms": {name: percentiles(values) for name, values in sorted(by_scenario.items())},
+        "stages_ms": dict(sorted(handlers.items())),
+        "db": main.db.stats(),
+        "history_writer": main.history_writer.stats(),
+        "outbound": main.outbound_scheduler.stats(),
+        "stub_calls": dict(sorted(stub.calls.items())),
+    }
+
+    await main.stop_services()
+    await translate_backend.close()
+    await main.bot.session.close()
+    await stub.stop()
+    return result
+
+
+def flatten(data, prefix=""):
+    for key, value in data.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+# Сравнение двух прогонов: ключевые показатели и изменение в процентах
+def compare(old_path, new_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+    old_values = dict(flatten(old))
+    for key, value in flatten(new):
+        if key.startswith("config.") or key not in old_values:
+            continue
+        if not key.startswith(("throughput", "latency_ms", "service_ms", "scenarios_ms", "db.", "errors")):
+            continue
+        before = old_values[key]
+        change = f"{(value - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{key:>40}: {before:>10} -> {value:>10} ({change})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=3000)
+    parser.add_argument("--rate", type=float, default=200, help="обновлений в секунду, 0 - без ограничения")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--admin-share", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--telegram-latency-ms", type=float, default=30)
+    parser.add_argument("--wiki-latency-ms", type=float, default=200)
+    parser.add_argument("--translate-latency-ms", type=float, default=150)
+    parser.add_argument("--rates-latency-ms", type=float, default=100)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--send-limits", action="store_true", help="не снимать лимиты исходящих сообщений")
+    parser.add_argument("--output", default="bench_load.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    result = asyncio.run(run(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"{result['updates']} обновлений за {result['elapsed_s']} с -> {result['throughput_ups']} обн/с, "
+          f"ошибок: {result['errors']}")
+    print(f"задержка, мс: {result['latency_ms']}")
+    print(f"база: {result['db']}")
+    print(f"результат записан в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# Поведение внешних интеграций при медленных и падающих сервисах: бот
+# (main.py) работает с локальными заглушками (stub_api.py), которые добавляют
+# задержку, редкие медленные ответы и ошибки 500. Сценарии:
+#   wiki_tail     - хвост задержек Википедии без дублирующих запросов и с ними (p50/p99);
+#   wiki_outage   - Википедия отвечает 500: выключатель размыкается, вызовы отклоняются
+#                   сразу, после восстановления и reset_timeout цепь снова замыкается;
+#   wiki_slow     - Википедия зависает: каждый вызов ограничен сроком;
+#   subscription  - getChatMember падает: пользователи с известным статусом сохраняют его,
+#                   остальные пропускаются (SUBSCRIPTION_FAIL_OPEN).
+# Запуск: python benchmarks/bench_resilience.py --calls 200 --hedge-ms 150 --output resilience.json
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_api import StubServer, StubWikiClient  # noqa: E402
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0, "p99": 0, "max": 0}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 1)
+    return {"p50": pick(0.5), "p99": pick(0.99), "max": round(values[-1] * 1000, 1)}
+
+
+# Вызовы fn(i) с ограниченной параллельностью: задержки и исходы
+async def drive(fn, count, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    outcomes = {}
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await fn(i)
+                outcome = "ok"
+            except Exception as e:
+                outcome = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return {"latency_ms": percentiles(latencies), "outcomes": outcomes}
+
+
+async def run(args):
+    stub = StubServer(wiki_latency=args.wiki_latency_ms / 1000, tail_rate=args.tail_rate,
+                      tail_latency=args.tail_latency_ms / 1000)
+    base_url = await stub.start()
+    workdir = tempfile.mkdtemp(prefix="bench_resilience_")
+    os.environ.update({
+        "BOT_TOKEN": "123456:BENCHMARK", "ADMIN_ID": "1", "CHANNEL_ID": "-1001",
+        "CHANNEL_URL": "https://t.me/benchmark", "DB_PATH": os.path.join(workdir, "bot.db"),
+        "TELEGRAM_API_URL": base_url, "RATES_URL": base_url + "/rates", "METRICS_PORT": "0",
+        "BREAKER_RESET_TIMEOUT": str(args.reset_timeout),
+    })
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import main
+        from resilience import Upstream
+    finally:
+        os.chdir(cwd)
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    main.wiki_service.client = StubWikiClient(base_url)
+    await main.start_services(resume_broadcasts=False, metrics_port=0, maintenance=False)
+
+    def wiki_upstream(**kwargs):
+        upstream = Upstream("wikipedia", reset_timeout=args.reset_timeout, **kwargs)
+        main.wiki_service.upstream = upstream
+        return upstream
+
+    result = {}
+    try:
+        # Хвост задержек: одни и те же условия без дублирования и с ним
+        result["wiki_tail"] = {}
+        for mode, hedge_ms in (("plain", 0), ("hedged", args.hedge_ms)):
+            upstream = wiki_upstream(timeout=10, hedge_after=hedge_ms / 1000 or None)
+            stub.calls.clear()
+            run_result = await drive(lambda i: main.wiki_service.summary(f"Хвост {mode} {i}"), args.calls,
+                                     args.concurrency)
+            run_result.update(upstream_requests=stub.calls["wiki"], **upstream.stats())
+            result["wiki_tail"][mode] = run_result
+            print(f"wiki_tail {mode}: {run_result['latency_ms']}, дублей {upstream.hedged}, "
+                  f"запросов к заглушке {stub.calls['wiki']}")
+
+        # Отказ и восстановление
+        upstream = wiki_upstream(timeout=10)
+        stub.calls.clear()
+        stub.error_rate["wiki"] = 1.0
+        outage = await drive(lambda i: main.wiki_service.summary(f"Отказ {i}"), args.calls // 4, 1)
+        outage.update(upstream_requests=stub.calls["wiki"], state=upstream.breaker.state)
+        stub.error_rate["wiki"] = 0.0
+        await asyncio.sleep(args.reset_timeout)
+        recovery = await drive(lambda i: main.wiki_service.summary(f"Восстановление {i}"), 10, 1)
+        recovery.update(state=upstream.breaker.state)
+        result["wiki_outage"] = {"outage": outage, "recovery": recovery, **upstream.stats()}
+        print(f"wiki_outage: {outage['outcomes']}, запросов к заглушке {outage['upstream_requests']}, "
+              f"после восстановления {recovery['outcomes']}, цепь {recovery['state']}")
+
+        # Зависший сервис: каждый вызов ограничен сроком
+        upstream = wiki_upstream(timeout=args.deadline_ms / 1000)
+        stub.latency["wiki"] = 3.0
+        slow = await drive(lambda i: main.wiki_service.summary(f"Зависание {i}"), 20, 1)
+        stub.latency["wiki"] = args.wiki_latency_ms / 1000
+        result["wiki_slow"] = {**slow, **upstream.stats()}
+        print(f"wiki_slow: {slow['latency_ms']}, {slow['outcomes']}")
+
+        # Проверка подписки при недоступном Telegram
+        users = list(range(1000, 1020))
+        for user_id in users[:10]:
+            await main.check_subscription(user_id)
+        main.subscription_cache.clear()
+        stub.error_rate["telegram"] = 1.0
+        statuses = [await main.check_subscription(user_id) for user_id in users]
+        stub.error_rate["telegram"] = 0.0
+        result["subscription"] = {"known_allowed": sum(statuses[:10]), "unknown_allowed": sum(statuses[10:]),
+                                  **main.subscription_upstream.stats()}
+        print(f"subscription: известные {sum(statuses[:10])}/10, новые {sum(statuses[10:])}/10 пропущены, "
+              f"цепь {main.subscription_upstream.breaker.state}")
+    finally:
+        await main.stop_services()
+        await main.bot.session.close()
+        await stub.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--wiki-latency-ms", type=float, default=20)
+    parser.add_argument("--tail-rate", type=float, default=0.05)
+    parser.add_argument("--tail-latency-ms", type=float, default=1000)
+    parser.add_argument("--hedge-ms", type=float, default=150)
+    parser.add_argument("--deadline-ms", type=float, default=300)
+    parser.add_argument("--reset-timeout", type=float, default=1.0)
+    parser.add_argument("--output", default="bench_resilience.json")
+    args = parser.parse_args()
+    result = asyncio.run(run(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"результат записан в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
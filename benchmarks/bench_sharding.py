@@ -0,0 +1,72 @@
+# Проверка шардированного режима на одной машине: синтетические обновления
+# раздаются N воркерам, каждый выполняет CPU-работу, сопоставимую со сборкой
+# ответа в обработчике. Бенчмарк проверяет порядок обновлений каждого пользователя
+# и печатает пропускную способность для разного числа воркеров.
+# Запуск: python benchmarks/bench_sharding.py --updates 20000 --workers 1 2 4
+import argparse
+import asyncio
+import functools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sharding import ShardedRunner, fake_updates, process_shard, update_user_id  # noqa: E402
+
+
+def busy_handler(update, work):
+    text = ""
+    for i in range(work):
+        text += f"🔹 {update['message']['text']} {i}\n"
+    return len(text)
+
+
+def worker(results, work, index, updates, heartbeats):
+    last_seen = {}
+    stats = {"handled": 0, "out_of_order": 0}
+
+    async def feed(update):
+        user_id = update_user_id(update)
+        if last_seen.get(user_id, 0) > update["update_id"]:
+            stats["out_of_order"] += 1
+        last_seen[user_id] = update["update_id"]
+        busy_handler(update, work)
+        stats["handled"] += 1
+        await asyncio.sleep(0)
+
+    asyncio.run(process_shard(updates, feed, heartbeats, index))
+    results.put(stats)
+
+
+async def run(workers, count, users, work):
+    import multiprocessing
+    results = multiprocessing.get_context("spawn").Queue()
+    runner = ShardedRunner(functools.partial(worker, results, work), workers)
+    runner.start()
+    await asyncio.sleep(1)  # даём воркерам запуститься
+    started = time.perf_counter()
+    for update in fake_updates(count, users):
+        await runner.dispatch(update)
+    await runner.stop(timeout=120)
+    elapsed = time.perf_counter() - started
+    totals = [results.get(timeout=10) for _ in range(workers)]
+    handled = sum(item["handled"] for item in totals)
+    out_of_order = sum(item["out_of_order"] for item in totals)
+    print(f"воркеров: {workers:>2}  обработано: {handled}  нарушений порядка: {out_of_order}  "
+          f"{handled / elapsed:.0f} обн/с")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--work", type=int, default=3000, help="объём CPU-работы на обновление")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+    for workers in args.workers:
+        asyncio.run(run(workers, args.updates, args.users, args.work))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# Время холодного запуска бота: несколько запусков в отдельных процессах,
+# каждый импортирует main.py, запускает службы и обрабатывает одно обновление
+# через заглушку Bot API (stub_api.py). Печатает медианы этапов из отчёта
+# startup.py (импорты, инициализация, первое обновление) и самые долгие импорты;
+# результат пишется в JSON, чтобы сравнивать релизы.
+# Запуск: python benchmarks/bench_startup.py --runs 5 --output startup.json
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_api import StubServer  # noqa: E402
+
+
+# Дочерний процесс: запуск бота до первого обработанного обновления
+async def child():
+    sys.path.insert(0, ROOT)
+    import main
+    await main.start_services(resume_broadcasts=False, metrics_port=0, maintenance=False)
+    main.STARTUP.mark("ready")
+    await main.dp.feed_raw_update(main.bot, {"update_id": 1, "message": {
+        "message_id": 1, "date": int(time.time()), "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "admin"}, "text": "/start"}})
+    # Сколько стоили бы googletrans и wikipediaapi, если создавать их при импорте
+    await main.warm_clients(0)
+    # Отчёт - в файл STARTUP_REPORT_PATH: в stdout поток журнала может писать и после него
+    main.STARTUP.write()
+    await main.stop_services()
+    await main.bot.session.close()
+
+
+async def run_once(base_url):
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    report_path = os.path.join(workdir, "startup.json")
+    env = dict(os.environ, BOT_TOKEN="123456:BENCHMARK", ADMIN_ID="1", CHANNEL_ID="-1001",
+               DB_PATH=os.path.join(workdir, "bot.db"), TELEGRAM_API_URL=base_url,
+               RATES_URL=base_url + "/rates", METRICS_PORT="0", CLIENT_WARMUP_DELAY="-1",
+               STARTUP_REPORT_PATH=report_path)
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), "--child",
+                                                   cwd=workdir, env=env, stdout=subprocess.DEVNULL)
+    await process.wait()
+    wall = (time.perf_counter() - started) * 1000
+    if process.returncode != 0:
+        raise RuntimeError(f"Дочерний процесс завершился с кодом {process.returncode}")
+    with open(report_path, encoding="utf-8") as f:
+        report = json.load(f)
+    report["wall_ms"] = round(wall, 1)
+    return report
+
+
+def median_of(reports, getter):
+    values = [value for value in (getter(report) for report in reports) if value is not None]
+    return round(statistics.median(values), 1) if values else None
+
+
+async def run(args):
+    stub = StubServer()
+    base_url = await stub.start()
+    reports = []
+    try:
+        for index in range(args.runs):
+            reports.append(await run_once(base_url))
+            print(f"запуск {index + 1}: {reports[-1]['phases_ms']}")
+    finally:
+        await stub.stop()
+    phases = reports[0]["phases_ms"].keys()
+    modules = {name for report in reports for name in report["imports_ms"]}
+    imports = {name: median_of(reports, lambda report: report["imports_ms"].get(name)) for name in modules}
+    extra = {key for report in reports for key in report if key.endswith("_init_ms")}
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "commit": commit,
+        "runs": args.runs,
+        "wall_ms": median_of(reports, lambda report: report["wall_ms"]),
+        "phases_ms": {phase: median_of(reports, lambda report: report["phases_ms"].get(phase)) for phase in phases},
+        "imports_ms": dict(sorted(imports.items(), key=lambda item: -item[1])),
+        **{key: median_of(reports, lambda report: report.get(key)) for key in sorted(extra)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", default="bench_startup.json")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        asyncio.run(child())
+        return
+    result = asyncio.run(run(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"медианы, мс: {result['phases_ms']}, процесс целиком: {result['wall_ms']}")
+    print("самые долгие импорты, мс:", dict(list(result["imports_ms"].items())[:8]))
+    print({key: value for key, value in result.items() if key.endswith("_init_ms")})
+    print(f"результат записан в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# Локальные заглушки внешних сервисов для нагрузочных тестов: Bot API,
+# Википедия, переводчик и курс валют в одном aiohttp-сервере.
+# Задержка каждого сервиса настраивается: latency + случайная добавка до jitter секунд,
+# а с вероятностью tail_rate - ещё tail_latency (редкие медленные ответы, хвост p99).
+# error_rate - доля ответов 500 по сервисам. latency и error_rate - словари,
+# их можно менять на ходу, чтобы изобразить отказ и восстановление сервиса.
+import asyncio
+import json
+import random
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+RATES = {"USD": 1.0, "EUR": 0.92, "GBP": 0.79, "RUB": 92.5, "UAH": 41.2, "UZS": 12650.0}
+
+
+class StubServer:
+    def __init__(self, telegram_latency=0.0, wiki_latency=0.0, translate_latency=0.0, rates_latency=0.0, jitter=0.0,
+                 tail_rate=0.0, tail_latency=0.0, error_rate=None):
+        self.latency = {"telegram": telegram_latency, "wiki": wiki_latency,
+                        "translate": translate_latency, "rates": rates_latency}
+        self.jitter = jitter
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.error_rate = dict.fromkeys(self.latency, 0.0)
+        self.error_rate.update(error_rate or {})
+        self.calls = Counter()
+        self.base_url = None
+        self._runner = None
+        self._message_id = 0
+
+    async def _delay(self, service):
+        delay = self.latency[service] + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if self.tail_rate and random.random() < self.tail_rate:
+            delay += self.tail_latency
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.error_rate[service] and random.random() < self.error_rate[service]:
+            self.calls[f"{service}.error"] += 1
+            raise web.HTTPInternalServerError()
+
+    def _message(self, chat_id, text=None):
+        self._message_id += 1
+        return {"message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "private" if int(chat_id) > 0 else "channel"},
+                "text": text or "ok"}
+
+    # POST /bot<token>/<method>: ответы в формате Bot API
+    async def handle_telegram(self, request):
+        method = request.match_info["method"]
+        self.calls[f"telegram.{method}"] += 1
+        form = await request.post()
+        await self._delay("telegram")
+        method = method.lower()
+        if method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+        elif method == "getchatmember":
+            user_id = int(form.get("user_id", 0))
+            result = {"status": "member", "user": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}}
+        elif method.startswith(("send", "copy", "forward", "editmessage")):
+            result = self._message(form.get("chat_id", 0), form.get("text"))
+        elif method == "getupdates":
+            result = []
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    # GET /wiki?title=...: статьи, начинающиеся с "Нет", не существуют
+    async def handle_wiki(self, request):
+        self.calls["wiki"] += 1
+        await self._delay("wiki")
+        title = request.query.get("title", "")
+        if title.startswith("Нет"):
+            return web.json_response({"exists": False})
+        return web.json_response({"exists": True, "summary": f"{title} - статья-заглушка. " * 40})
+
+    # POST /translate {"texts": [...], "src": ..., "dest": ...}
+    async def handle_translate(self, request):
+        self.calls["translate"] += 1
+        payload = await request.json()
+        await self._delay("translate")
+        return web.json_response({"texts": [f"{text} ({payload.get('dest', 'en')})" for text in payload["texts"]]})
+
+    async def handle_rates(self, request):
+        self.calls["rates"] += 1
+        await self._delay("rates")
+        return web.json_response({"base": "USD", "rates": RATES})
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle_telegram)
+        app.router.add_get("/wiki", self.handle_wiki)
+        app.router.add_post("/translate", self.handle_translate)
+        app.router.add_get("/rates", self.handle_rates)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+# Клиент Википедии с интерфейсом wikipediaapi (page().exists(), .summary).
+# Синхронный, как и настоящий: WikiService вызывает его в пуле потоков.
+class StubWikiPage:
+    def __init__(self, data):
+        self._data = data
+        self.summary = data.get("summary", "")
+
+    def exists(self):
+        return self._data.get("exists", False)
+
+
+class StubWikiClient:
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def page(self, title):
+        url = f"{self.base_url}/wiki?" + urllib.parse.urlencode({"title": title})
+        with urllib.request.urlopen(url, timeout=30) as response:
+            return StubWikiPage(json.load(response))
+
+
+# Бэкенд TranslationService, который ходит в заглушку переводчика
+class StubTranslateBackend:
+    def __init__(self, base_url):
+        self.url = base_url + "/translate"
+        self._session = None
+
+    async def translate(self, texts, src, dest):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        async with self._session.post(self.url, json={"texts": texts, "src": src, "dest": dest}) as response:
+            response.raise_for_status()
+            return (await response.json())["texts"]
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from sender import send_priority, ADMIN, BULK
+
+logger = logging.getLogger(__name__)
+
+# Ответы Bot API, после которых пользователю больше не стоит писать
+UNREACHABLE_ERRORS = ("chat not found", "user is deactivated", "bot was blocked", "bot can't initiate")
+
+
+# Рассылка по всем пользователям из user_stats.
+# Получатели читаются страницами по курсору user_id, страница отправляется
+# с ограниченной параллельностью в очереди BULK планировщика (он же держит
+# общий лимит скорости). После каждой страницы прогресс сохраняется в таблицу
+# broadcasts, поэтому после перезапуска рассылка продолжается с того же места
+# (повторно может уйти не больше одной страницы). Заблокировавшие бота
+# пользователи записываются в blocked_users и пропускаются в следующих рассылках.
+# Базу могут делить несколько процессов (инстансы вебхука, web + bot), поэтому
+# рассылку ведёт только процесс-владелец: он захватывает её атомарным UPDATE
+# (owner, lease_until) и продлевает аренду перед каждой страницей. Если владелец
+# пропал, после истечения аренды рассылку подхватывает другой процесс.
+# Перед каждой страницей проверяется и статус, так что /broadcast_stop,
+# принятый любым процессом, останавливает рассылку.
+class BroadcastEngine:
+    def __init__(self, bot, db, concurrency=25, page_size=100, progress_interval=5.0, lease=60.0):
+        self.bot = bot
+        self.db = db
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks = {}
+        self._watcher = None
+
+    @property
+    def running(self):
+        return sorted(self._tasks)
+
+    async def start(self, text, admin_chat_id):
+        with send_priority(ADMIN):
+            message = await self.bot.send_message(admin_chat_id, "📣 Рассылка запускается...")
+        job_id = await self.db.transaction(lambda conn: conn.execute(
+            '''INSERT INTO broadcasts (text, admin_chat_id, progress_message_id, owner, lease_until)
+               VALUES (?, ?, ?, ?, ?)''',
+            (text, admin_chat_id, message.message_id, self.owner, time.time() + self.lease)).lastrowid)
+        self._spawn(job_id)
+        return job_id
+
+    # Захват незавершённых рассылок без владельца или с истёкшей арендой
+    async def resume(self):
+        rows = await self.db.fetchall('''SELECT id FROM broadcasts WHERE status = 'running'
+                                         AND (owner IS NULL OR lease_until < ?)''', (time.time(),))
+        resumed = []
+        for (job_id,) in rows:
+            if job_id in self._tasks or not await self._claim(job_id):
+                continue
+            logger.info(f"Продолжаем рассылку #{job_id}")
+            self._spawn(job_id)
+            resumed.append(job_id)
+        return resumed
+
+    async def _claim(self, job_id):
+        return await self.db.execute('''UPDATE broadcasts SET owner = ?, lease_until = ?
+                                        WHERE id = ? AND status = 'running' AND (owner IS NULL OR lease_until < ?)''',
+                                     (self.owner, time.time() + self.lease, job_id, time.time())) == 1
+
+    # Продление аренды; False - рассылка отменена или перешла к другому процессу
+    async def _renew(self, job_id):
+        return await self.db.execute("UPDATE broadcasts SET lease_until = ? "
+                                     "WHERE id = ? AND owner = ? AND status = 'running'",
+                                     (time.time() + self.lease, job_id, self.owner)) == 1
+
+    # Периодический resume: подхватывает рассылки процессов, которые остановились без передачи
+    def watch(self):
+        if self._watcher is None:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        while True:
+            try:
+                await self.resume()
+            except Exception as e:
+                logger.error(f"Не удалось проверить незавершённые рассылки: {e}")
+            await asyncio.sleep(self.lease / 2)
+
+    # True, если рассылка шла и теперь отменена
+    async def cancel(self, job_id):
+        cancelled = await self.db.execute("UPDATE broadcasts SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP "
+                                          "WHERE id = ? AND status = 'running'", (job_id,))
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        return cancelled > 0
+
+    async def unblock(self, user_id):
+        await self.db.execute('DELETE FROM blocked_users WHERE user_id = ?', (user_id,))
+
+    # Остановка без отметки об отмене: аренда снимается, и рассылку сразу
+    # подхватит другой процесс или этот же при следующем запуске
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        if self._watcher is not None:
+            tasks.append(self._watcher)
+            self._watcher = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.db.execute("UPDATE broadcasts SET owner = NULL, lease_until = NULL "
+                              "WHERE owner = ? AND status = 'running'", (self.owner,))
+
+    def _spawn(self, job_id):
+        if job_id not in self._tasks:
+            task = asyncio.create_task(self._run(job_id))
+            self._tasks[job_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def _run(self, job_id):
+        job = await self.db.fetchone('''SELECT text, last_user_id, sent, blocked, failed, admin_chat_id, progress_message_id
+                                        FROM broadcasts WHERE id = ?''', (job_id,))
+        text, cursor, sent, blocked, failed, admin_chat_id, progress_message_id = job
+        started = time.monotonic()
+        started_sent = sent
+        last_report = 0.0
+        semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            while True:
+                if not await self._renew(job_id):
+                    logger.info(f"Рассылка #{job_id} отменена или передана другому процессу")
+                    return
+                rows = await self.db.fetchall('''SELECT s.user_id FROM user_stats s
+                                                 LEFT JOIN blocked_users b ON b.user_id = s.user_id
+                                                 WHERE s.user_id > ? AND b.user_id IS NULL
+                                                 ORDER BY s.user_id LIMIT ?''', (cursor, self.page_size))
+                if not rows:
+                    break
+                results = await asyncio.gather(*(self._send(semaphore, user_id, text) for (user_id,) in rows))
+                cursor = rows[-1][0]
+                newly_blocked = [(user_id, reason) for (user_id,), (status, reason) in zip(rows, results)
+                                 if status == "blocked"]
+                page_sent = sum(status == "sent" for status, _ in results)
+                page_failed = sum(status == "failed" for status, _ in results)
+                sent += page_sent
+                blocked += len(newly_blocked)
+                failed += page_failed
+                await self.db.transaction(self._checkpoint, job_id, cursor, page_sent, len(newly_blocked),
+                                          page_failed, newly_blocked)
+                if time.monotonic() - last_report >= self.progress_interval:
+                    last_report = time.monotonic()
+                    await self._report(admin_chat_id, progress_message_id, job_id, "⏳ идёт",
+                                       sent, blocked, failed, (sent - started_sent) / (last_report - started))
+            await self.db.execute("UPDATE broadcasts SET status = 'done', finished_at = CURRENT_TIMESTAMP, "
+                                  "owner = NULL, lease_until = NULL "
+                                  "WHERE id = ? AND status = 'running' AND owner = ?", (job_id, self.owner))
+            elapsed = max(time.monotonic() - started, 1e-6)
+            await self._report(admin_chat_id, progress_message_id, job_id, "✅ завершена",
+                               sent, blocked, failed, (sent - started_sent) / elapsed)
+        except Exception as e:
+            logger.error(f"Рассылка #{job_id} прервана: {e}")
+
+    @staticmethod
+    def _checkpoint(conn, job_id, cursor, sent, blocked, failed, newly_blocked):
+        conn.execute('''UPDATE broadcasts SET last_user_id = ?, sent = sent + ?, blocked = blocked + ?,
+                        failed = failed + ? WHERE id = ?''', (cursor, sent, blocked, failed, job_id))
+        conn.executemany('INSERT OR IGNORE INTO blocked_users (user_id, reason) VALUES (?, ?)', newly_blocked)
+
+    async def _send(self, semaphore, user_id, text):
+        async with semaphore:
+            try:
+                with send_priority(BULK):
+                    await self.bot.send_message(user_id, text)
+                return "sent", None
+            except TelegramForbiddenError as e:
+                return "blocked", e.message
+            except TelegramBadRequest as e:
+                if any(reason in e.message.lower() for reason in UNREACHABLE_ERRORS):
+                    return "blocked", e.message
+                return "failed", e.message
+            except Exception as e:
+                logger.warning(f"Рассылка: не удалось отправить {user_id}: {e}")
+                return "failed", str(e)
+
+    async def _report(self, chat_id, message_id, job_id, status, sent, blocked, failed, rate):
+        text = (f"📣 Рассылка #{job_id}: {status}\n\n"
+                f"✅ Доставлено: {sent}\n"
+                f"🚫 Недоступны: {blocked}\n"
+                f"❌ Ошибок: {failed}\n"
+                f"⚡️ Скорость: {rate:.1f} сообщ./с")
+        try:
+            with send_priority(ADMIN):
+                await self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс рассылки #{job_id}: {e}")
@@ -0,0 +1,54 @@
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters import Filter
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+
+
+# Кнопки reply-клавиатур: текст кнопки -> обработчик, выбор обработчика - один
+# поиск в dict вместо перебора фильтров F.text == "..." по очереди.
+# Клавиатуры строятся здесь же из текстов кнопок, поэтому кнопка без обработчика
+# или обработчик кнопки, которой нет ни на одной клавиатуре, - ошибка при запуске.
+class ButtonRouter(Filter):
+    def __init__(self):
+        self.texts = set()
+        self.routes = {}
+
+    def keyboard(self, rows, resize_keyboard=True, **kwargs):
+        for row in rows:
+            self.texts.update(row)
+        return ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text=text) for text in row] for row in rows],
+                                   resize_keyboard=resize_keyboard, **kwargs)
+
+    # Обработчик кнопок; с state кнопки работают только в этом состоянии FSM
+    def button(self, *texts, state=None):
+        def decorator(fn):
+            handler = CallableObject(fn)
+            for text in texts:
+                if text not in self.texts:
+                    raise ValueError(f"Кнопки «{text}» нет ни на одной клавиатуре")
+                if text in self.routes:
+                    raise ValueError(f"У кнопки «{text}» уже есть обработчик")
+                self.routes[text] = (state.state if state is not None else None, handler)
+            return fn
+        return decorator
+
+    # Фильтр единственного обработчика: найденный обработчик кнопки попадает в data["button"]
+    async def __call__(self, message, raw_state=None):
+        route = self.routes.get(message.text)
+        if route is None:
+            return False
+        state, handler = route
+        if state is not None and state != raw_state:
+            return False
+        return {"button": handler}
+
+    @staticmethod
+    async def dispatch(message, button, **data):
+        return await button.call(message, **data)
+
+    # Регистрируется после обработчиков состояний FSM: ввод в состоянии
+    # (например, ФИО в ComplaintForm) не должен приниматься за нажатие кнопки
+    def register(self, observer):
+        missing = self.texts - self.routes.keys()
+        if missing:
+            raise RuntimeError(f"Нет обработчиков для кнопок: {', '.join(sorted(missing))}")
+        observer.register(self.dispatch, self)
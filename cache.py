@@ -0,0 +1,122 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+# Ограниченный по размеру LRU-кэш, у каждой записи свой срок жизни
+class TTLCache:
+    def __init__(self, maxsize=10000, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        item = self._data.get(key)
+        return item is not None and item[1] > time.monotonic()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        value, expires_at = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        self._data.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 3),
+            "evictions": self.evictions,
+        }
+
+
+# Объединение одновременных одинаковых запросов в один вызов:
+# пока запрос по ключу выполняется, остальные ждут его результата
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def run(self, key, fn, *args):
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn(*args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self):
+        return {"in_flight": len(self._inflight), "calls": self.calls, "coalesced": self.coalesced}
+
+
+# Отсечение промежуточных запросов: из серии запросов с одним ключом (например,
+# inline-запросы пользователя, которые Telegram шлёт на каждую набранную букву)
+# дальше проходит только тот, за которым delay секунд не пришло следующего
+class Debouncer:
+    def __init__(self, delay):
+        self.delay = delay
+        self._latest = {}
+        self.passed = 0
+        self.dropped = 0
+
+    # True, если запрос остался последним; False, если его вытеснил более новый
+    async def wait(self, key):
+        token = object()
+        self._latest[key] = token
+        await asyncio.sleep(self.delay)
+        if self._latest.get(key) is not token:
+            self.dropped += 1
+            return False
+        del self._latest[key]
+        self.passed += 1
+        return True
+
+    def stats(self):
+        return {"waiting": len(self._latest), "passed": self.passed, "dropped": self.dropped}
@@ -0,0 +1,155 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Настройки, применяемые к каждому соединению пула
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+# Долгоживущий слой доступа к SQLite.
+# Все записи идут через одно соединение в отдельном потоке (SQLite всё равно
+# сериализует писателей), чтения - через небольшой пул соединений-читателей.
+# Каждое соединение держит кэш подготовленных выражений (cached_statements),
+# поэтому повторяющиеся запросы не компилируются заново.
+class Database:
+    def __init__(self, path, readers=2, statement_cache=256):
+        self.path = path
+        self.readers = max(1, readers)
+        self.statement_cache = statement_cache
+        self._writer = None
+        self._reader = None
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        # Очередь к пулу: [вызовов, суммарное ожидание, максимальное ожидание] по пулам
+        self._waits = {"writer": [0, 0.0, 0.0], "reader": [0, 0.0, 0.0]}
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False,
+                               cached_statements=self.statement_cache)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _init_thread(self):
+        self._local.conn = self._connect()
+
+    def _conn(self):
+        return self._local.conn
+
+    # Открытие пула, вызывается один раз из init_db()
+    def open(self):
+        if self.is_open:
+            return
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer",
+                                          initializer=self._init_thread)
+        self._reader = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="db-reader",
+                                          initializer=self._init_thread)
+
+    def close(self):
+        if not self.is_open:
+            return
+        self._writer.shutdown(wait=True)
+        self._reader.shutdown(wait=True)
+        self._writer = self._reader = None
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+    async def _run(self, executor, fn, *args):
+        if executor is None:
+            raise RuntimeError("База данных не открыта, сначала вызовите init_db()")
+        waits = self._waits["writer" if executor is self._writer else "reader"]
+        submitted = time.perf_counter()
+
+        # Время от постановки в очередь до начала выполнения - мера конкуренции за соединения
+        def call():
+            waited = time.perf_counter() - submitted
+            with self._lock:
+                waits[0] += 1
+                waits[1] += waited
+                waits[2] = max(waits[2], waited)
+            return fn(*args)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, call)
+
+    # Выполнение fn(conn, *args) в одной транзакции на соединении-писателе
+    def _transaction(self, fn, *args):
+        conn = self._conn()
+        try:
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+        except BaseException:
+            conn.rollback()
+            raise
+
+    async def transaction(self, fn, *args):
+        return await self._run(self._writer, self._transaction, fn, *args)
+
+    async def execute(self, sql, params=()):
+        return await self.transaction(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def executemany(self, sql, seq_of_params):
+        return await self.transaction(lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    # Применение миграций, которые новее PRAGMA user_version.
+    # Миграция - SQL-скрипт или функция fn(conn); каждая выполняется атомарно.
+    def _migrate(self, migrations):
+        conn = self._conn()
+        old_version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for version in range(old_version + 1, len(migrations) + 1):
+            migration = migrations[version - 1]
+            try:
+                if callable(migration):
+                    migration(conn)
+                    conn.execute(f"PRAGMA user_version = {version}")
+                    conn.commit()
+                else:
+                    conn.executescript(f"BEGIN;\n{migration}\nPRAGMA user_version = {version};\nCOMMIT;")
+            except BaseException:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+        return old_version, max(old_version, len(migrations))
+
+    async def migrate(self, migrations):
+        return await self._run(self._writer, self._migrate, migrations)
+
+    async def executescript(self, script):
+        await self._run(self._writer, lambda: self._conn().executescript(script))
+
+    # Выполнение fn(conn, *args) на одном из соединений-читателей
+    async def read(self, fn, *args):
+        return await self._run(self._reader, lambda: fn(self._conn(), *args))
+
+    async def fetchone(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    def stats(self):
+        stats = {}
+        with self._lock:
+            for pool, (calls, total, longest) in self._waits.items():
+                stats[f"{pool}_calls"] = calls
+                stats[f"{pool}_avg_wait_ms"] = round(total / calls * 1000, 2) if calls else 0
+                stats[f"{pool}_max_wait_ms"] = round(longest * 1000, 2)
+        return stats
@@ -0,0 +1,147 @@
+import asyncio
+import datetime
+import logging
+import time
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+INSERT_HISTORY = '''INSERT INTO query_history (user_id, username, query_type, query_text, timestamp)
+                    VALUES (?, ?, ?, ?, ?)'''
+
+UPSERT_STATS = '''INSERT INTO user_stats
+                  (user_id, username, total_queries, wiki_queries, translate_queries, last_active)
+                  VALUES (?, ?, ?, ?, ?, ?)
+                  ON CONFLICT(user_id) DO UPDATE SET
+                      username = excluded.username,
+                      total_queries = total_queries + excluded.total_queries,
+                      wiki_queries = wiki_queries + excluded.wiki_queries,
+                      translate_queries = translate_queries + excluded.translate_queries,
+                      last_active = excluded.last_active'''
+
+UPSERT_COUNTS = '''INSERT INTO query_counts (query_text, count) VALUES (?, ?)
+                   ON CONFLICT(query_text) DO UPDATE SET count = count + excluded.count'''
+
+
+# Отложенная запись истории запросов и статистики пользователей.
+# Обработчики только кладут событие в буфер, а фоновая задача раз в
+# flush_interval секунд (или при накоплении batch_size событий) записывает
+# всё одной транзакцией: пакетный INSERT в историю, один UPSERT на пользователя
+# и один UPSERT на текст запроса в query_counts.
+class HistoryWriter:
+    def __init__(self, db, flush_interval=0.5, batch_size=200):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._events = []
+        self._pending_users = set()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+        # Счётчики для /perf
+        self.flushes = 0
+        self.events_flushed = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def queue_depth(self):
+        return len(self._events)
+
+    def add(self, user_id, username, query_type, query_text):
+        timestamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        self._events.append((user_id, username, query_type, query_text, timestamp))
+        self._pending_users.add(user_id)
+        if len(self._events) >= self.batch_size:
+            self._wakeup.set()
+
+    def has_pending(self, user_id):
+        return user_id in self._pending_users
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        if self._events:
+            logger.error(f"При остановке не удалось записать {len(self._events)} событий истории")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при записи истории запросов: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._events:
+                return
+            events, self._events = self._events, []
+            users, self._pending_users = self._pending_users, set()
+            started = time.perf_counter()
+            try:
+                with timed("db.history_flush"):
+                    await self.db.transaction(self._write, events, self._aggregate(events))
+            except Exception:
+                # Возвращаем события в начало буфера, чтобы не потерять их
+                self._events[:0] = events
+                self._pending_users |= users
+                self.failed_flushes += 1
+                raise
+            elapsed = (time.perf_counter() - started) * 1000
+            self.flushes += 1
+            self.events_flushed += len(events)
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self.total_flush_ms += elapsed
+
+    @staticmethod
+    def _aggregate(events):
+        deltas = {}
+        for user_id, username, query_type, _, timestamp in events:
+            row = deltas.get(user_id)
+            if row is None:
+                row = deltas[user_id] = [user_id, username, 0, 0, 0, timestamp]
+            row[1] = username
+            row[2] += 1
+            row[3] += query_type == "wiki"
+            row[4] += query_type == "translate"
+            row[5] = timestamp
+        return [tuple(row) for row in deltas.values()]
+
+    @staticmethod
+    def _write(conn, events, deltas):
+        counts = {}
+        for event in events:
+            counts[event[3]] = counts.get(event[3], 0) + 1
+        conn.executemany(INSERT_HISTORY, events)
+        conn.executemany(UPSERT_STATS, deltas)
+        conn.executemany(UPSERT_COUNTS, counts.items())
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "flushes": self.flushes,
+            "events_flushed": self.events_flushed,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+        }
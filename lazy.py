@@ -0,0 +1,44 @@
+import asyncio
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Клиент внешнего сервиса, который создаётся при первом обращении.
+# factory() выполняет тяжёлый импорт и конструирование (googletrans, wikipediaapi),
+# поэтому они не задерживают запуск бота. Атрибуты прокидываются к настоящему
+# клиенту, так что объект можно передавать туда, где ждут сам клиент.
+# Потокобезопасен: WikiService обращается к клиенту из пула потоков.
+class LazyClient:
+    def __init__(self, factory, name):
+        self._factory = factory
+        self._name = name
+        self._client = None
+        self._lock = threading.Lock()
+        self.init_seconds = None
+
+    @property
+    def created(self):
+        return self._client is not None
+
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    started = time.perf_counter()
+                    self._client = self._factory()
+                    self.init_seconds = time.perf_counter() - started
+                    logger.info(f"Клиент {self._name} создан за {self.init_seconds * 1000:.0f} мс")
+        return self._client
+
+    # Создание заранее, в пуле потоков, чтобы первый запрос пользователя не ждал импорт
+    async def warm(self):
+        if self._client is None:
+            await asyncio.to_thread(self.get)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
@@ -0,0 +1,174 @@
+import atexit
+import contextvars
+import copy
+import datetime
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import shutil
+import sys
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Поля контекста обновления, которые попадают в записи журнала
+CONTEXT_FIELDS = ("update_id", "user_id", "handler", "latency_ms")
+
+# Контекст текущего обновления: dict, который заполняют middleware
+log_context = contextvars.ContextVar("log_context", default=None)
+
+_listener = None
+
+
+# Копирует контекст обновления в запись. Работает в потоке, который пишет
+# в журнал (до очереди), поэтому видит contextvars обработчика.
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        context = log_context.get()
+        if context:
+            for field in CONTEXT_FIELDS:
+                if field in context and not hasattr(record, field):
+                    setattr(record, field, context[field])
+        return True
+
+
+# Выборка шумных info-журналов (например, aiogram.event пишет строку на каждое
+# обновление): из указанных логгеров проходит доля rate записей уровня ниже WARNING
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate=1.0, loggers=()):
+        super().__init__()
+        self.rate = rate
+        self.loggers = tuple(loggers)
+
+    def filter(self, record):
+        if self.rate >= 1.0 or record.levelno >= logging.WARNING:
+            return True
+        if not record.name.startswith(self.loggers):
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# Сообщение и трассировка собираются в потоке вызова (аргументы могут измениться
+# позже), а оформление (текст или JSON) - в потоке записи
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+# Ротированный файл сжимается в gzip (bot.log.1 -> bot.log.1.gz)
+def _gzip_namer(name):
+    return name + ".gz"
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _file_handler(path, max_bytes, when, backup_count, compress):
+    if when:
+        handler = logging.handlers.TimedRotatingFileHandler(path, when=when, backupCount=backup_count,
+                                                            encoding="utf-8", delay=True)
+    elif max_bytes:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                       encoding="utf-8", delay=True)
+    else:
+        return logging.FileHandler(path, encoding="utf-8", delay=True)
+    if compress:
+        handler.namer = _gzip_namer
+        handler.rotator = _gzip_rotator
+    return handler
+
+
+# Неблокирующее логирование: логгеры только кладут записи в очередь в памяти,
+# форматирование и запись в файл/stdout делает отдельный поток QueueListener.
+# Повторный вызов заменяет прежнюю настройку (воркеры пишут в свои файлы).
+def setup_logging(path="bot.log", level="INFO", fmt="text", max_bytes=10 * 1024 * 1024, when=None,
+                  backup_count=7, compress=True, sample_rate=1.0, sampled_loggers=("aiogram.event",)):
+    global _listener
+    shutdown_logging()
+
+    formatter = JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if path:
+        handlers.append(_file_handler(path, max_bytes, when, backup_count, compress))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    queue_handler = _QueueHandler(records)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(sample_rate, sampled_loggers))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+# Дописывает записи из очереди и закрывает файлы (при выходе из процесса)
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+# Поле контекста текущего обновления (например, имя обработчика)
+def set_log_field(name, value):
+    context = log_context.get()
+    if context is not None:
+        context[name] = value
+
+
+# Outer-middleware диспетчера: заводит контекст журнала для обновления
+class LogContextMiddleware:
+    async def __call__(self, handler, event, data):
+        context = {"update_id": event.update_id}
+        user = data.get("event_from_user")
+        if user is not None:
+            context["user_id"] = user.id
+        token = log_context.set(context)
+        try:
+            return await handler(event, data)
+        finally:
+            log_context.reset(token)
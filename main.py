@@ -1,30 +1,50 @@
+# Замер времени запуска (startup.py) - до всех остальных импортов
+from startup import STARTUP
+STARTUP.track_imports()
+
 import os
+import signal
 import datetime
 import random
-import sqlite3
 import asyncio
+import csv
+import json
+import hashlib
+import tempfile
+from urllib.parse import quote
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import Command
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.filters import Command, CommandObject
+from aiogram.filters.callback_data import CallbackData
 from aiogram.filters.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest
 from dotenv import load_dotenv
-import requests
-import wikipediaapi
-from googletrans import Translator
+from database import Database
+from schema import MIGRATIONS
+from history_writer import HistoryWriter
+from cache import TTLCache, SingleFlight, Debouncer
+from wiki import WikiService
+from translate import TranslationService, GoogleTranslateBackend
+from rates import RatesService
+from webhook import run_webhook
+from storage import SQLiteStorage, CachedStorage, create_redis_storage
+from sender import OutboundScheduler, send_priority, ADMIN
+from broadcast import BroadcastEngine
+from sharding import ShardedRunner, process_shard, poll_updates
+from buttons import ButtonRouter
+from maintenance import MaintenanceJob
+from lazy import LazyClient
+from metrics import REGISTRY, timed, UpdateMetricsMiddleware, HandlerMetricsMiddleware, start_metrics_server
+from logs import setup_logging, LogContextMiddleware
+from resilience import Upstream, CircuitOpenError
 import logging
-import sys
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+STARTUP.mark("imports")
+
 logger = logging.getLogger(__name__)
 
 # Загрузка переменных окружения
@@ -34,47 +54,195 @@ TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
 CHANNEL_ID = os.getenv("CHANNEL_ID")  # ID канала для обязательной подписки
 CHANNEL_URL = os.getenv("CHANNEL_URL")  # URL для вступления в канал
+DB_PATH = os.getenv("DB_PATH", "bot_database.db")
+DB_READERS = int(os.getenv("DB_READERS", "2"))  # Число соединений-читателей в пуле
+HISTORY_FLUSH_INTERVAL_MS = int(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "500"))  # Период записи истории
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "200"))  # Досрочная запись при таком числе событий
+SUBSCRIBED_TTL = float(os.getenv("SUBSCRIBED_TTL", "600"))  # Сколько секунд помнить, что пользователь подписан
+NOT_SUBSCRIBED_TTL = float(os.getenv("NOT_SUBSCRIBED_TTL", "30"))  # Сколько секунд помнить, что не подписан
+SUBSCRIPTION_CACHE_SIZE = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "50000"))
+WIKI_CACHE_SIZE = int(os.getenv("WIKI_CACHE_SIZE", "5000"))  # Статей в памяти
+WIKI_CACHE_TTL = float(os.getenv("WIKI_CACHE_TTL", str(7 * 24 * 3600)))  # Срок жизни найденной статьи, с
+WIKI_NOT_FOUND_TTL = float(os.getenv("WIKI_NOT_FOUND_TTL", "3600"))  # Срок жизни ответа "не найдено", с
+INLINE_RESULTS = int(os.getenv("INLINE_RESULTS", "5"))  # Статей в ответе на inline-запрос
+INLINE_SUMMARIES = int(os.getenv("INLINE_SUMMARIES", "2"))  # Для скольких из них загружать краткое содержание
+INLINE_MIN_QUERY = int(os.getenv("INLINE_MIN_QUERY", "3"))  # Более короткие запросы не ищутся
+INLINE_DEBOUNCE_MS = int(os.getenv("INLINE_DEBOUNCE_MS", "400"))  # Пауза в наборе, после которой запрос уходит в Википедию
+INLINE_SEARCH_TTL = float(os.getenv("INLINE_SEARCH_TTL", "3600"))  # Срок жизни результатов поиска в кэше бота, с
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "3600"))  # Срок кэширования ответа на стороне Telegram, с
+INLINE_NOT_SUBSCRIBED_CACHE_TIME = 10  # Ответ неподписанному: после подписки поиск заработает почти сразу
+TRANSLATE_CONCURRENCY = int(os.getenv("TRANSLATE_CONCURRENCY", "4"))  # Одновременных запросов к переводчику
+TRANSLATE_CACHE_SIZE = int(os.getenv("TRANSLATE_CACHE_SIZE", "10000"))
+TRANSLATE_BATCH_WINDOW_MS = int(os.getenv("TRANSLATE_BATCH_WINDOW_MS", "20"))  # Окно сбора микропакета
+RATES_URL = os.getenv("RATES_URL", "https://api.exchangerate-api.com/v4/latest/USD")
+RATES_REFRESH_INTERVAL = float(os.getenv("RATES_REFRESH_INTERVAL", "600"))  # Период обновления курсов, с
+RATES_TIMEOUT = float(os.getenv("RATES_TIMEOUT", "10"))  # Таймаут запроса курсов, с
+# Защита от медленных и недоступных внешних сервисов: срок на вызов (с), дублирующий
+# запрос, если ответа нет дольше *_HEDGE_MS (0 - выключено), и выключатель
+WIKI_TIMEOUT = float(os.getenv("WIKI_TIMEOUT", "10"))
+WIKI_HEDGE_MS = int(os.getenv("WIKI_HEDGE_MS", "0"))
+TRANSLATE_TIMEOUT = float(os.getenv("TRANSLATE_TIMEOUT", "10"))
+TRANSLATE_HEDGE_MS = int(os.getenv("TRANSLATE_HEDGE_MS", "0"))
+SUBSCRIPTION_TIMEOUT = float(os.getenv("SUBSCRIPTION_TIMEOUT", "5"))
+SUBSCRIPTION_HEDGE_MS = int(os.getenv("SUBSCRIPTION_HEDGE_MS", "0"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))  # Ошибок подряд, после которых вызовы отклоняются сразу
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))  # Через сколько секунд пробовать снова
+# Если Telegram недоступен (таймаут, разомкнутый выключатель): последний известный статус
+# (хранится столько секунд), а для пользователей без него - пропускать (1) или нет (0)
+SUBSCRIPTION_KNOWN_TTL = float(os.getenv("SUBSCRIPTION_KNOWN_TTL", str(7 * 24 * 3600)))
+SUBSCRIPTION_FAIL_OPEN = os.getenv("SUBSCRIPTION_FAIL_OPEN", "1") == "1"
+# Свой сервер Bot API (локальный telegram-bot-api или заглушка нагрузочного теста)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Режим запуска: polling (по умолчанию) или webhook
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Внешний адрес, например https://example.com; без него вебхук не регистрируется
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Секретный токен, который Telegram присылает в заголовке (обязателен)
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("PORT", "8080"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))  # Ожидание обработчиков при остановке, с
+WEBHOOK_DRAIN_GRACE = float(os.getenv("WEBHOOK_DRAIN_GRACE", "5"))  # Сколько секунд /health отдаёт 503 до остановки приёма
+# Хранилище состояний FSM: sqlite (по умолчанию), redis или memory
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_REDIS_URL = os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0")
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", str(24 * 3600)))  # Через сколько секунд брошенное состояние удаляется
+# Кэш чтения состояний (только для sqlite); 0 - выключен. Выключайте, если базу делят
+# несколько процессов (инстансы вебхука, web и bot): иначе состояние, записанное одним, другой
+# видит с опозданием до FSM_CACHE_TTL. Воркеры WORKERS>1 делят пользователей и кэш не мешает
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "60"))
+# Ограничения исходящих сообщений (лимиты Bot API)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))  # Сообщений в секунду на весь бот
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))  # Сообщений в секунду в личный чат
+SEND_GROUP_RATE_PER_MIN = float(os.getenv("SEND_GROUP_RATE_PER_MIN", "20"))  # Сообщений в минуту в группу
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))  # Сколько сообщений в чат можно отправить подряд
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "25"))  # Одновременных отправок рассылки
+# Шардирование: при WORKERS > 1 фронтовой процесс раздаёт обновления воркерам по user_id
+WORKERS = int(os.getenv("WORKERS", "1"))
+WORKER_HEALTH_INTERVAL = float(os.getenv("WORKER_HEALTH_INTERVAL", "5"))  # Период проверки воркеров, с
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT", "30"))  # Воркер без отклика перезапускается, с
+# Метрики: /metrics на локальном порту (0 - выключено), воркеры занимают следующие порты
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+SLOW_UPDATE_MS = float(os.getenv("SLOW_UPDATE_MS", "0"))  # Порог журнала медленных обновлений, 0 - выключен
+# Обслуживание базы: история старше срока сворачивается в дневные счётчики
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "90"))  # 0 - хранить историю бессрочно
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", str(24 * 3600)))  # Период обслуживания, с
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "500"))  # Записей истории на транзакцию
+# Переводить старую базу в incremental auto_vacuum в плановом проходе: полный VACUUM
+# останавливает запись в базу на время перестройки файла (иначе - /maintenance vacuum)
+DB_CONVERT_AUTO_VACUUM = os.getenv("DB_CONVERT_AUTO_VACUUM", "0") == "1"
+# googletrans и wikipediaapi создаются при первом обращении или в фоне через столько секунд после запуска
+CLIENT_WARMUP_DELAY = float(os.getenv("CLIENT_WARMUP_DELAY", "5"))  # Отрицательное значение - только по требованию
+STARTUP_REPORT_PATH = os.getenv("STARTUP_REPORT_PATH")  # JSON-отчёт о времени запуска (после первого обновления)
+# Журнал: запись через очередь в отдельном потоке, ротация по размеру или по времени со сжатием
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")  # Пустое значение - только stdout
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text или json (с полями update_id, user_id, handler, latency_ms)
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))  # Ротация по размеру, 0 - без неё
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN")  # Ротация по времени (midnight, H, ...) вместо ротации по размеру
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "7"))
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "1") == "1"  # Сжимать ротированные файлы в gzip
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))  # Доля info-записей шумных логгеров, которая пишется
+LOG_SAMPLED_LOGGERS = tuple(name for name in os.getenv("LOG_SAMPLED_LOGGERS", "aiogram.event,metrics.updates").split(",") if name)
+
+# Настройка логирования
+def configure_logging(path=LOG_FILE):
+    setup_logging(path, level=LOG_LEVEL, fmt=LOG_FORMAT, max_bytes=LOG_MAX_BYTES, when=LOG_ROTATE_WHEN,
+                  backup_count=LOG_BACKUP_COUNT, compress=LOG_COMPRESS, sample_rate=LOG_SAMPLE_RATE,
+                  sampled_loggers=LOG_SAMPLED_LOGGERS)
+
+configure_logging()
 
 # Инициализация бота и диспетчера
-bot = Bot(token=TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
-translator = Translator()
-wiki_wiki = wikipediaapi.Wikipedia(language='ru', user_agent='your_email@example.com')
-
-# Клавиатуры
-menu_kb = ReplyKeyboardMarkup(
-    keyboard=[
-        [KeyboardButton(text="📑 Жалобы/Предложения"), KeyboardButton(text="🔎 Википедия")],
-        [KeyboardButton(text="🌤 Погода"), KeyboardButton(text="🈹 Переводчик"), KeyboardButton(text="💰 Курс валют")],
-        [KeyboardButton(text="📅 Дата и время"), KeyboardButton(text="🎲 Случайное число"), KeyboardButton(text="📍 Местоположение")],
-        [KeyboardButton(text="📊 Моя статистика"), KeyboardButton(text="⭐️ Избранное"), KeyboardButton(text="📜 История"), KeyboardButton(text="🗑 Очистить историю")]
-    ],
-    resize_keyboard=True
-)
+bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+          if TELEGRAM_API_URL else None)
+# Воркеры шардированного режима отправляют независимо, поэтому общий лимит делится между ними
+# (фронтовой процесс сообщений не отправляет)
+outbound_scheduler = OutboundScheduler(global_rate=SEND_GLOBAL_RATE / max(1, WORKERS), private_rate=SEND_CHAT_RATE,
+                                       group_rate=SEND_GROUP_RATE_PER_MIN / 60, chat_burst=SEND_CHAT_BURST)
+bot.session.middleware(outbound_scheduler)
+db = Database(DB_PATH, readers=DB_READERS)
 
-stats_kb = ReplyKeyboardMarkup(
-    keyboard=[
-        [KeyboardButton(text="📊 Моя статистика"), KeyboardButton(text="📜 История")],
-        [KeyboardButton(text="⭐️ Избранное"), KeyboardButton(text="🗑 Очистить историю")],
-        [KeyboardButton(text="🔙 Назад в главное меню")]
-    ],
-    resize_keyboard=True
-)
+# Хранилище состояний FSM
+def create_fsm_storage():
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if FSM_STORAGE == "redis":
+        # Redis разделяют несколько процессов - кэш в памяти одного из них отдавал бы чужое устаревшее состояние
+        return create_redis_storage(FSM_REDIS_URL, state_ttl=FSM_STATE_TTL)
+    backend = SQLiteStorage(db, state_ttl=FSM_STATE_TTL)
+    if FSM_CACHE_SIZE <= 0:
+        return backend
+    return CachedStorage(backend, maxsize=FSM_CACHE_SIZE, ttl=FSM_CACHE_TTL)
 
-favorites_kb = ReplyKeyboardMarkup(
-    keyboard=[
-        [KeyboardButton(text="➕ Добавить в избранное"), KeyboardButton(text="➖ Удалить из избранного")],
-        [KeyboardButton(text="🔙 Назад в главное меню")]
-    ],
-    resize_keyboard=True
-)
+fsm_storage = create_fsm_storage()
+dp = Dispatcher(storage=fsm_storage)
 
-confirm_kb = ReplyKeyboardMarkup(
-    keyboard=[
-        [KeyboardButton(text="✅ Подтвердить"), KeyboardButton(text="❌ Отмена")]
-    ],
-    resize_keyboard=True
-)
+# Тяжёлые клиенты внешних сервисов импортируются и создаются при первом использовании
+def create_translator():
+    from googletrans import Translator
+    return Translator()
+
+def create_wiki_client():
+    import wikipediaapi
+    return wikipediaapi.Wikipedia(language='ru', user_agent='your_email@example.com')
+
+translator = LazyClient(create_translator, "googletrans")
+wiki_wiki = LazyClient(create_wiki_client, "wikipediaapi")
+# Внешние сервисы: срок, выключатель и дублирование запросов (состояние - в /perf)
+def create_upstream(name, timeout, hedge_ms=0, ignore=()):
+    return Upstream(name, timeout=timeout, failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_TIMEOUT,
+                    hedge_after=hedge_ms / 1000 if hedge_ms else None, ignore=ignore)
+
+wiki_upstream = create_upstream("wikipedia", WIKI_TIMEOUT, WIKI_HEDGE_MS)
+translate_upstream = create_upstream("googletrans", TRANSLATE_TIMEOUT, TRANSLATE_HEDGE_MS)
+rates_upstream = create_upstream("exchange_rates", RATES_TIMEOUT)
+# Ошибки запроса (нет пользователя, бот не админ канала) - ответ Telegram, а не сбой
+subscription_upstream = create_upstream("get_chat_member", SUBSCRIPTION_TIMEOUT, SUBSCRIPTION_HEDGE_MS,
+                                        ignore=(TelegramBadRequest,))
+upstreams = (wiki_upstream, translate_upstream, rates_upstream, subscription_upstream)
+history_writer = HistoryWriter(db, flush_interval=HISTORY_FLUSH_INTERVAL_MS / 1000, batch_size=HISTORY_BATCH_SIZE)
+wiki_service = WikiService(wiki_wiki, db, memory_size=WIKI_CACHE_SIZE, ttl=WIKI_CACHE_TTL, not_found_ttl=WIKI_NOT_FOUND_TTL,
+                           search_limit=INLINE_RESULTS, search_summaries=INLINE_SUMMARIES, search_ttl=INLINE_SEARCH_TTL, upstream=wiki_upstream)
+inline_debouncer = Debouncer(INLINE_DEBOUNCE_MS / 1000)
+translation_service = TranslationService(GoogleTranslateBackend(translator), concurrency=TRANSLATE_CONCURRENCY,
+                                         cache_size=TRANSLATE_CACHE_SIZE, batch_window=TRANSLATE_BATCH_WINDOW_MS / 1000,
+                                         upstream=translate_upstream)
+rates_service = RatesService(RATES_URL, refresh_interval=RATES_REFRESH_INTERVAL, timeout=RATES_TIMEOUT,
+                             upstream=rates_upstream)
+broadcast_engine = BroadcastEngine(bot, db, concurrency=BROADCAST_CONCURRENCY)
+maintenance_job = MaintenanceJob(db, retention_days=HISTORY_RETENTION_DAYS, interval=MAINTENANCE_INTERVAL,
+                                 batch_size=MAINTENANCE_BATCH_SIZE, convert_auto_vacuum=DB_CONVERT_AUTO_VACUUM)
+subscription_cache = TTLCache(maxsize=SUBSCRIPTION_CACHE_SIZE)
+subscription_flight = SingleFlight()
+# Последний полученный от Telegram статус подписки - на случай, когда проверка не удалась
+subscription_known = TTLCache(maxsize=SUBSCRIPTION_CACHE_SIZE, ttl=SUBSCRIPTION_KNOWN_TTL)
+
+# Клавиатуры: тексты кнопок - единственный источник и для разметки, и для маршрутизации (см. buttons.py)
+buttons = ButtonRouter()
+
+menu_kb = buttons.keyboard([
+    ["📑 Жалобы/Предложения", "🔎 Википедия"],
+    ["🌤 Погода", "🈹 Переводчик", "💰 Курс валют"],
+    ["📅 Дата и время", "🎲 Случайное число", "📍 Местоположение"],
+    ["📊 Моя статистика", "⭐️ Избранное", "📜 История", "🗑 Очистить историю"],
+])
+
+stats_kb = buttons.keyboard([
+    ["📊 Моя статистика", "📜 История"],
+    ["⭐️ Избранное", "🗑 Очистить историю"],
+    ["🔙 Назад в главное меню"],
+])
+
+favorites_kb = buttons.keyboard([
+    ["➕ Добавить в избранное", "➖ Удалить из избранного"],
+    ["🔙 Назад в главное меню"],
+])
+
+confirm_kb = buttons.keyboard([
+    ["✅ Подтвердить", "❌ Отмена"],
+])
 
 # Создаем клавиатуру для подписки на канал
 subscribe_kb = InlineKeyboardMarkup(
@@ -85,140 +253,211 @@ subscribe_kb = InlineKeyboardMarkup(
 )
 
 # Инициализация базы данных
-def init_db():
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    # Таблица истории запросов
-    c.execute('''CREATE TABLE IF NOT EXISTS query_history
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id INTEGER,
-                  username TEXT,
-                  query_type TEXT,
-                  query_text TEXT,
-                  timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-    # Таблица избранных запросов
-    c.execute('''CREATE TABLE IF NOT EXISTS favorites
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  user_id INTEGER,
-                  query_type TEXT,
-                  query_text TEXT,
-                  timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-    # Таблица статистики пользователей
-    c.execute('''CREATE TABLE IF NOT EXISTS user_stats
-                 (user_id INTEGER PRIMARY KEY,
-                  username TEXT,
-                  total_queries INTEGER DEFAULT 0,
-                  wiki_queries INTEGER DEFAULT 0,
-                  translate_queries INTEGER DEFAULT 0,
-                  last_active DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-    conn.commit()
-    conn.close()
-
-# Функция для сохранения запроса в базу данных
-def save_query(user_id, username, query_type, query_text):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('INSERT INTO query_history (user_id, username, query_type, query_text) VALUES (?, ?, ?, ?)',
-              (user_id, username, query_type, query_text))
-    conn.commit()
-    conn.close()
-    update_user_stats(user_id, username, query_type)
-
-# Функция для обновления статистики пользователя
-def update_user_stats(user_id, username, query_type):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('''INSERT OR REPLACE INTO user_stats 
-                 (user_id, username, total_queries, wiki_queries, translate_queries, last_active)
-                 VALUES (?, ?, COALESCE((SELECT total_queries + 1 FROM user_stats WHERE user_id = ?), 1),
-                         COALESCE((SELECT wiki_queries + ? FROM user_stats WHERE user_id = ?), ?),
-                         COALESCE((SELECT translate_queries + ? FROM user_stats WHERE user_id = ?), ?),
-                         CURRENT_TIMESTAMP)''',
-              (user_id, username, user_id, 1 if query_type == "wiki" else 0, user_id, 1 if query_type == "wiki" else 0,
-               1 if query_type == "translate" else 0, user_id, 1 if query_type == "translate" else 0))
-    conn.commit()
-    conn.close()
+async def init_db():
+    db.open()
+    old_version, new_version = await db.migrate(MIGRATIONS)
+    if old_version != new_version:
+        logger.info(f"Схема базы данных обновлена: v{old_version} -> v{new_version}")
+
+# Функция для сохранения запроса в базу данных (запись отложенная, см. HistoryWriter)
+@timed("db.save_query")
+async def save_query(user_id, username, query_type, query_text):
+    history_writer.add(user_id, username, query_type, query_text)
+
+# Дописываем отложенные события пользователя, чтобы он сразу видел свои запросы
+async def flush_pending(user_id):
+    if history_writer.has_pending(user_id):
+        await history_writer.flush()
 
 # Функция для добавления в избранное
-def add_to_favorites(user_id, query_type, query_text):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('INSERT INTO favorites (user_id, query_type, query_text) VALUES (?, ?, ?)',
-              (user_id, query_type, query_text))
-    conn.commit()
-    conn.close()
-
-# Функция для получения избранных запросов
-def get_favorites(user_id):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('SELECT query_type, query_text, timestamp FROM favorites WHERE user_id = ? ORDER BY timestamp DESC',
-              (user_id,))
-    favorites = c.fetchall()
-    conn.close()
-    return favorites
+@timed("db.add_to_favorites")
+async def add_to_favorites(user_id, query_type, query_text):
+    await db.execute('INSERT INTO favorites (user_id, query_type, query_text) VALUES (?, ?, ?)',
+                     (user_id, query_type, query_text))
 
 # Функция для удаления из избранного
-def remove_from_favorites(user_id, query_text):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('DELETE FROM favorites WHERE user_id = ? AND query_text = ?', (user_id, query_text))
-    conn.commit()
-    conn.close()
+@timed("db.remove_from_favorites")
+async def remove_from_favorites(user_id, query_text):
+    await db.execute('DELETE FROM favorites WHERE user_id = ? AND query_text = ?', (user_id, query_text))
 
 # Функция для получения статистики пользователя
-def get_user_stats(user_id):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM user_stats WHERE user_id = ?', (user_id,))
-    stats = c.fetchone()
-    conn.close()
-    return stats
-
-# Функция для получения истории запросов пользователя
-def get_user_history(user_id, limit=5):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('''SELECT query_type, query_text, timestamp 
-                 FROM query_history 
-                 WHERE user_id = ? 
-                 ORDER BY timestamp DESC 
-                 LIMIT ?''', (user_id, limit))
-    history = c.fetchall()
-    conn.close()
-    return history
+@timed("db.get_user_stats")
+async def get_user_stats(user_id):
+    await flush_pending(user_id)
+    return await db.fetchone('SELECT * FROM user_stats WHERE user_id = ?', (user_id,))
+
+# Списки пользователя с постраничным просмотром: вид -> (таблица, заголовок, текст для пустого списка)
+USER_LISTS = {
+    "history": ("query_history", "📜 Ваша история запросов:", "📝 У вас пока нет истории запросов."),
+    "favorites": ("favorites", "⭐️ Ваши избранные запросы:", "📝 У вас пока нет избранных запросов."),
+}
+USER_LIST_PAGE_SIZE = 10
+USER_LIST_TEXT_LIMIT = 200  # Длинные запросы обрезаются, чтобы страница помещалась в одно сообщение
+USER_LIST_COLUMNS = 'id, query_type, query_text, timestamp'
+
+# Страница истории или избранного по курсору id, от новых записей к старым:
+# один запрос по индексу (user_id, id) независимо от длины списка.
+# direction: None - первая страница, "next" - после курсора, "prev" - перед курсором.
+@timed("db.get_user_list_page")
+async def get_user_list_page(kind, user_id, direction=None, cursor=None, limit=USER_LIST_PAGE_SIZE):
+    table = USER_LISTS[kind][0]
+    if kind == "history":
+        await flush_pending(user_id)
+    if direction == "prev":
+        rows = await db.fetchall(f'''SELECT {USER_LIST_COLUMNS} FROM {table}
+                                     WHERE user_id = ? AND id > ?
+                                     ORDER BY id LIMIT ?''', (user_id, cursor, limit + 1))
+        return rows[:limit][::-1], len(rows) > limit, True
+    if direction == "next":
+        rows = await db.fetchall(f'''SELECT {USER_LIST_COLUMNS} FROM {table}
+                                     WHERE user_id = ? AND id < ?
+                                     ORDER BY id DESC LIMIT ?''', (user_id, cursor, limit + 1))
+        return rows[:limit], True, len(rows) > limit
+    rows = await db.fetchall(f'''SELECT {USER_LIST_COLUMNS} FROM {table}
+                                 WHERE user_id = ?
+                                 ORDER BY id DESC LIMIT ?''', (user_id, limit + 1))
+    return rows[:limit], False, len(rows) > limit
+
+# Выгрузка всей истории пользователя в файл: строки читаются из курсора порциями
+# и сразу пишутся, поэтому память не зависит от размера истории
+def _export_user_history(conn, user_id, path, fmt):
+    cursor = conn.execute(f'SELECT {USER_LIST_COLUMNS} FROM query_history WHERE user_id = ? ORDER BY id', (user_id,))
+    columns = [column[0] for column in cursor.description]
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        if fmt == "csv":
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            write_rows = writer.writerows
+        else:
+            def write_rows(rows):
+                f.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            write_rows(rows)
+            count += len(rows)
+    return count
+
+@timed("db.export_user_history")
+async def export_user_history(user_id, fmt):
+    await flush_pending(user_id)
+    fd, path = tempfile.mkstemp(prefix='history_', suffix=f'.{fmt}')
+    os.close(fd)
+    try:
+        count = await db.read(_export_user_history, user_id, path, fmt)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, count
 
 # Функция для получения популярных запросов
-def get_popular_queries(limit=5):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('''SELECT query_text, COUNT(*) as count 
-                 FROM query_history 
-                 GROUP BY query_text 
+@timed("db.get_popular_queries")
+async def get_popular_queries(limit=5):
+    return await db.fetchall('''SELECT query_text, count 
+                 FROM query_counts 
                  ORDER BY count DESC 
                  LIMIT ?''', (limit,))
-    popular = c.fetchall()
-    conn.close()
-    return popular
 
 # Функция для очистки истории пользователя
-def clear_user_history(user_id):
-    conn = sqlite3.connect('bot_database.db')
-    c = conn.cursor()
-    c.execute('DELETE FROM query_history WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
-
-# Функция проверки подписки на канал
+@timed("db.clear_user_history")
+async def clear_user_history(user_id):
+    await flush_pending(user_id)
+    await db.transaction(_clear_user_history, user_id)
+
+def _clear_user_history(conn, user_id):
+    # Вычитаем удаляемые запросы из счётчиков популярности
+    conn.execute('''UPDATE query_counts
+                    SET count = count - (SELECT COUNT(*) FROM query_history h
+                                         WHERE h.user_id = ? AND h.query_text = query_counts.query_text)
+                    WHERE query_text IN (SELECT query_text FROM query_history WHERE user_id = ?)''',
+                 (user_id, user_id))
+    conn.execute('DELETE FROM query_counts WHERE count <= 0')
+    conn.execute('DELETE FROM query_history WHERE user_id = ?', (user_id,))
+    # Свёрнутая старая история по тексту не разбита, поэтому в query_counts она остаётся
+    conn.execute('DELETE FROM query_daily WHERE user_id = ?', (user_id,))
+
+# Сортировки статистики администратора: ключ -> (столбец, подпись кнопки)
+STATS_SORTS = {
+    "total": ("total_queries", "📚 По запросам"),
+    "active": ("last_active", "⏰ По активности"),
+}
+ADMIN_STATS_PAGE_SIZE = 20
+STATS_COLUMNS = 'user_id, username, total_queries, wiki_queries, translate_queries, last_active'
+
+# Страница статистики по курсору (значение сортировки, user_id), от больших к меньшим.
+# direction: None - первая страница, "next" - после курсора, "prev" - перед курсором.
+@timed("db.get_stats_page")
+async def get_stats_page(sort, direction=None, cursor=None, limit=ADMIN_STATS_PAGE_SIZE):
+    column = STATS_SORTS[sort][0]
+    if direction == "prev":
+        rows = await db.fetchall(f'''SELECT {STATS_COLUMNS} FROM user_stats
+                                     WHERE ({column}, user_id) > (?, ?)
+                                     ORDER BY {column}, user_id LIMIT ?''', (*cursor, limit + 1))
+        return rows[:limit][::-1], len(rows) > limit, True
+    if direction == "next":
+        rows = await db.fetchall(f'''SELECT {STATS_COLUMNS} FROM user_stats
+                                     WHERE ({column}, user_id) < (?, ?)
+                                     ORDER BY {column} DESC, user_id DESC LIMIT ?''', (*cursor, limit + 1))
+        return rows[:limit], True, len(rows) > limit
+    rows = await db.fetchall(f'''SELECT {STATS_COLUMNS} FROM user_stats
+                                 ORDER BY {column} DESC, user_id DESC LIMIT ?''', (limit + 1,))
+    return rows[:limit], False, len(rows) > limit
+
+# Выгрузка всей статистики в CSV-файл порциями, без загрузки таблицы в память
+def _export_stats_csv(conn, path):
+    cursor = conn.execute(f'SELECT {STATS_COLUMNS} FROM user_stats ORDER BY user_id')
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([column[0] for column in cursor.description])
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            writer.writerows(rows)
+
+@timed("db.export_stats_csv")
+async def export_stats_csv():
+    fd, path = tempfile.mkstemp(prefix='user_stats_', suffix='.csv')
+    os.close(fd)
+    await db.read(_export_stats_csv, path)
+    return path
+
+# Функция проверки подписки на канал (с кэшем и объединением одновременных проверок)
+@timed("subscription.check")
 async def check_subscription(user_id):
+    is_subscribed = subscription_cache.get(user_id)
+    if is_subscribed is not None:
+        return is_subscribed
+    return await subscription_flight.run(user_id, fetch_subscription, user_id)
+
+async def fetch_subscription(user_id):
     try:
-        member = await bot.get_chat_member(chat_id=CHANNEL_ID, user_id=user_id)
-        if member.status in ['creator', 'administrator', 'member']:
-            return True
+        with timed("external.get_chat_member"):
+            member = await subscription_upstream.call(bot.get_chat_member, CHANNEL_ID, user_id)
+    except TelegramBadRequest as e:
+        # Telegram ответил, но проверить нельзя (например, бот больше не администратор канала) -
+        # это ошибка настройки, а не сбой: не пропускаем и не спрашиваем снова до NOT_SUBSCRIBED_TTL
+        logger.error(f"Проверка подписки невозможна: {e.message}")
+        subscription_cache.set(user_id, False, ttl=NOT_SUBSCRIBED_TTL)
         return False
     except Exception as e:
-        logger.error(f"Ошибка при проверке подписки: {e}")
-        return False
+        # Таймаут или разомкнутый выключатель не должны запирать пользователей: последний
+        # известный статус, а без него - как задано в SUBSCRIPTION_FAIL_OPEN
+        known = subscription_known.get(user_id)
+        is_subscribed = known if known is not None else SUBSCRIPTION_FAIL_OPEN
+        if not isinstance(e, CircuitOpenError):
+            logger.warning(f"Ошибка при проверке подписки: {e!r}, считаем подписка={is_subscribed}")
+        return is_subscribed
+    is_subscribed = member.status in ['creator', 'administrator', 'member']
+    subscription_cache.set(user_id, is_subscribed,
+                           ttl=SUBSCRIBED_TTL if is_subscribed else NOT_SUBSCRIBED_TTL)
+    subscription_known.set(user_id, is_subscribed)
+    return is_subscribed
+
+def is_channel(chat):
+    return str(chat.id) == str(CHANNEL_ID) or (chat.username is not None and f"@{chat.username}" == CHANNEL_ID)
 
 # Функция-middleware для проверки подписки
 async def subscription_filter(handler, event, data):
@@ -228,6 +467,10 @@ async def subscription_filter(handler, event, data):
         if user.id == ADMIN_ID:
             return await handler(event, data)
         
+        # Кнопка "Проверить подписку" всегда спрашивает Telegram заново
+        if isinstance(event, types.CallbackQuery) and event.data == "check_subscription":
+            subscription_cache.pop(user.id)
+        
         # Проверяем подписку
         is_subscribed = await check_subscription(user.id)
         if not is_subscribed:
@@ -248,6 +491,120 @@ async def subscription_filter(handler, event, data):
 # Регистрация middleware
 dp.message.middleware(subscription_filter)
 dp.callback_query.middleware(subscription_filter)
+# Контекст журнала (update_id, user_id, обработчик) для каждого обновления
+dp.update.outer_middleware(LogContextMiddleware())
+# Отчёт о запуске ждёт первое обработанное обновление
+STARTUP.path = STARTUP_REPORT_PATH
+dp.update.outer_middleware(STARTUP)
+# Метрики: обновления целиком и время каждого обработчика
+dp.update.outer_middleware(UpdateMetricsMiddleware(slow_threshold=SLOW_UPDATE_MS / 1000))
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+dp.inline_query.middleware(HandlerMetricsMiddleware())
+REGISTRY.collector("db", db.stats)
+REGISTRY.collector("history_writer", lambda: history_writer.stats())
+REGISTRY.collector("maintenance", lambda: maintenance_job.stats())
+REGISTRY.collector("startup", STARTUP.stats)
+REGISTRY.collector("subscription_cache", lambda: subscription_cache.stats())
+REGISTRY.collector("wiki", lambda: wiki_service.stats())
+REGISTRY.collector("wiki_search", lambda: wiki_service.search_stats())
+REGISTRY.collector("inline_debounce", lambda: inline_debouncer.stats())
+REGISTRY.collector("translate", lambda: translation_service.stats())
+REGISTRY.collector("rates", lambda: rates_service.stats())
+REGISTRY.collector("outbound", lambda: outbound_scheduler.stats())
+for upstream in upstreams:
+    REGISTRY.collector(f"upstream_{upstream.name}", upstream.stats)
+if isinstance(fsm_storage, CachedStorage):
+    REGISTRY.collector("fsm_cache", fsm_storage.stats)
+
+# Изменение статуса участника канала сбрасывает кэш подписки
+@dp.chat_member()
+async def on_channel_member_update(update: types.ChatMemberUpdated):
+    if is_channel(update.chat):
+        subscription_cache.pop(update.new_chat_member.user.id)
+
+# Данные кнопок постраничной статистики администратора
+class AdminStatsPage(CallbackData, prefix="astats"):
+    sort: str
+    direction: str = ""
+    value: str = ""
+    user_id: int = 0
+
+class AdminStatsExport(CallbackData, prefix="astats_csv"):
+    pass
+
+# Данные кнопок постраничных истории и избранного (cursor - id крайней записи страницы)
+class UserListPage(CallbackData, prefix="ulist"):
+    kind: str
+    direction: str = ""
+    cursor: int = 0
+
+# Курсор в callback_data: двоеточия не допускаются, поэтому дата хранится одними цифрами
+def encode_stats_cursor(sort, row):
+    value = row[2] if sort == "total" else row[5]
+    return "".join(ch for ch in str(value) if ch.isdigit()), row[0]
+
+def decode_stats_cursor(sort, value, user_id):
+    if sort == "total":
+        return int(value), user_id
+    return f"{value[0:4]}-{value[4:6]}-{value[6:8]} {value[8:10]}:{value[10:12]}:{value[12:14]}", user_id
+
+def render_stats_page(sort, rows, has_prev, has_next):
+    lines = [f"📊 Статистика всех пользователей ({STATS_SORTS[sort][1]}):", ""]
+    for _, username, total, wiki, translate, last_active in rows:
+        lines.append(f"👤 {username}:")
+        lines.append(f"📚 Всего: {total}")
+        lines.append(f"🔍 Википедия: {wiki}")
+        lines.append(f"🔄 Переводы: {translate}")
+        lines.append(f"⏰ {last_active}")
+        lines.append("")
+    navigation = []
+    if has_prev:
+        value, user_id = encode_stats_cursor(sort, rows[0])
+        navigation.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=AdminStatsPage(
+            sort=sort, direction="prev", value=value, user_id=user_id).pack()))
+    if has_next:
+        value, user_id = encode_stats_cursor(sort, rows[-1])
+        navigation.append(InlineKeyboardButton(text="Вперёд ➡️", callback_data=AdminStatsPage(
+            sort=sort, direction="next", value=value, user_id=user_id).pack()))
+    sorts = [InlineKeyboardButton(text=label, callback_data=AdminStatsPage(sort=key).pack())
+             for key, (_, label) in STATS_SORTS.items() if key != sort]
+    export = [InlineKeyboardButton(text="📄 Выгрузить CSV", callback_data=AdminStatsExport().pack())]
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[row for row in (navigation, sorts, export) if row])
+    return "\n".join(lines), keyboard
+
+def render_user_list_page(kind, rows, has_prev, has_next):
+    lines = [USER_LISTS[kind][1], ""]
+    for _, query_type, query_text, timestamp in rows:
+        query_text = query_text or ""
+        if len(query_text) > USER_LIST_TEXT_LIMIT:
+            query_text = query_text[:USER_LIST_TEXT_LIMIT] + "…"
+        lines.append(f"🔹 {query_type}: {query_text}")
+        lines.append(f"⏰ {timestamp}")
+        lines.append("")
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=UserListPage(
+            kind=kind, direction="prev", cursor=rows[0][0]).pack()))
+    if has_next:
+        navigation.append(InlineKeyboardButton(text="Вперёд ➡️", callback_data=UserListPage(
+            kind=kind, direction="next", cursor=rows[-1][0]).pack()))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[navigation]) if navigation else None
+    return "\n".join(lines), keyboard
+
+# Первая страница списка. У сообщения одна клавиатура, поэтому если нужны кнопки
+# листания, обычная клавиатура раздела приходит отдельным сообщением.
+async def send_user_list(message, kind, reply_kb):
+    rows, has_prev, has_next = await get_user_list_page(kind, message.from_user.id)
+    if not rows:
+        await message.answer(USER_LISTS[kind][2], reply_markup=reply_kb)
+        return
+    text, keyboard = render_user_list_page(kind, rows, has_prev, has_next)
+    if keyboard is None:
+        await message.answer(text, reply_markup=reply_kb)
+    else:
+        await message.answer(text, reply_markup=keyboard)
+        await message.answer("⬆️ Листайте список кнопками под ним.", reply_markup=reply_kb)
 
 # Классы состояний
 class ComplaintForm(StatesGroup):
@@ -272,6 +629,8 @@ class FavoriteManage(StatesGroup):
 # Обработчики команд
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
+    # Пользователь снова пишет боту - значит, рассылки до него снова доходят
+    await broadcast_engine.unblock(message.from_user.id)
     await message.answer("👋 Привет! Я бот-справочник. Чем могу помочь?", reply_markup=menu_kb, parse_mode="HTML")
 
 @dp.message(Command("help"))
@@ -280,6 +639,7 @@ async def cmd_help(message: types.Message):
                  "/start - Начать работу с ботом\n"
                  "/help - Получить справку по функциям бота\n"
                  "/history - Показать историю ваших запросов\n"
+                 "/export - Выгрузить всю историю запросов (JSONL, /export csv - CSV)\n"
                  "/clear_history - Очистить историю запросов\n"
                  "/stats - Показать вашу статистику\n"
                  "/favorites - Показать избранные запросы\n"
@@ -305,7 +665,7 @@ async def callback_check_subscription(callback: types.CallbackQuery):
         await callback.answer("Вы ещё не подписались на канал!", show_alert=True)
 
 # Жалобы/Предложения
-@dp.message(F.text == "📑 Жалобы/Предложения")
+@buttons.button("📑 Жалобы/Предложения")
 async def process_complaint_start(message: types.Message, state: FSMContext):
     await state.set_state(ComplaintForm.full_name)
     await message.answer("📝 Пожалуйста, введите ваше ФИО:")
@@ -333,7 +693,7 @@ async def process_complaint_text(message: types.Message, state: FSMContext):
     await state.set_state(ComplaintForm.confirm)
     await message.answer(confirmation_text, reply_markup=confirm_kb)
 
-@dp.message(ComplaintForm.confirm, F.text.in_(["✅ Подтвердить", "❌ Отмена"]))
+@buttons.button("✅ Подтвердить", "❌ Отмена", state=ComplaintForm.confirm)
 async def process_confirmation(message: types.Message, state: FSMContext):
     if message.text == "✅ Подтвердить":
         data = await state.get_data()
@@ -341,30 +701,78 @@ async def process_confirmation(message: types.Message, state: FSMContext):
                          f"👤 ФИО: {data['full_name']}\n"
                          f"📞 Контакт: {data['contact']}\n"
                          f"📝 Текст: {data['complaint_text']}")
-        await bot.send_message(ADMIN_ID, admin_message)
+        with send_priority(ADMIN):
+            await bot.send_message(ADMIN_ID, admin_message)
         await message.answer("✅ Ваше сообщение успешно отправлено администратору.", reply_markup=menu_kb)
     else:
         await message.answer("❌ Отправка отменена.", reply_markup=menu_kb)
     await state.clear()
 
 # Википедия
-@dp.message(F.text == "🔎 Википедия")
+@buttons.button("🔎 Википедия")
 async def process_wiki_start(message: types.Message, state: FSMContext):
     await state.set_state(WikiSearch.searching)
     await message.answer("🔎 Введите запрос для поиска в Википедии:", parse_mode="HTML")
 
 @dp.message(WikiSearch.searching)
 async def process_wiki_search(message: types.Message, state: FSMContext):
-    page = wiki_wiki.page(message.text)
-    if page.exists():
-        save_query(message.from_user.id, message.from_user.username or str(message.from_user.id), "wiki", message.text)
-        await message.answer(f"📚 {page.summary[:1000]}...", parse_mode="HTML")
+    try:
+        summary = await wiki_service.summary(message.text)
+    except Exception as e:
+        logger.warning(f"Википедия недоступна: {e!r}")
+        await message.answer("⚠️ Википедия сейчас недоступна, попробуйте позже.")
+        await state.clear()
+        return
+    if summary is not None:
+        await save_query(message.from_user.id, message.from_user.username or str(message.from_user.id), "wiki", message.text)
+        await message.answer(f"📚 {summary[:1000]}...", parse_mode="HTML")
     else:
         await message.answer("❌ Страница не найдена.", parse_mode="HTML")
     await state.clear()
 
+# Inline-режим: "@бот запрос" в любом чате, ответ - статьи Википедии
+# Без краткого содержания в сообщение уходит фрагмент из поиска
+def wiki_inline_result(title, snippet, summary):
+    text = summary or snippet
+    return types.InlineQueryResultArticle(
+        id=hashlib.md5(title.encode()).hexdigest(),
+        title=title,
+        description=(snippet or text)[:200],
+        url=f"https://ru.wikipedia.org/wiki/{quote(title.replace(' ', '_'))}",
+        input_message_content=types.InputTextMessageContent(message_text=f"📚 {title}\n\n{text[:1000]}..."),
+    )
+
+@dp.inline_query()
+async def process_inline_wiki(inline_query: types.InlineQuery):
+    query = inline_query.query.strip()
+    if len(query) < INLINE_MIN_QUERY:
+        await inline_query.answer([], cache_time=INLINE_CACHE_TIME, is_personal=False)
+        return
+    # Подписка проверяется и здесь: middleware подписки стоит только на сообщениях и кнопках
+    user_id = inline_query.from_user.id
+    if user_id != ADMIN_ID and not await check_subscription(user_id):
+        await inline_query.answer([], cache_time=INLINE_NOT_SUBSCRIBED_CACHE_TIME, is_personal=True,
+                                  button=types.InlineQueryResultsButton(text="Подпишитесь на канал, чтобы искать",
+                                                                        start_parameter="subscribe"))
+        return
+    results = wiki_service.cached_search(query)
+    if results is None:
+        # Telegram шлёт запрос на каждую набранную букву: в Википедию уходит
+        # только последний, промежуточные остаются без ответа
+        if not await inline_debouncer.wait(inline_query.from_user.id):
+            return
+        try:
+            results = await wiki_service.search(query)
+        except Exception as e:
+            logger.warning(f"Inline-поиск недоступен: {e!r}")
+            return
+    # Кэш Telegram - для каждого пользователя свой (иначе неподписанные получали бы чужие
+    # ответы, не доходя до бота); общий для всех кэш результатов - wiki_service
+    await inline_query.answer([wiki_inline_result(*result) for result in results],
+                              cache_time=INLINE_CACHE_TIME, is_personal=True)
+
 # Переводчик
-@dp.message(F.text == "🈹 Переводчик")
+@buttons.button("🈹 Переводчик")
 async def process_translate_start(message: types.Message, state: FSMContext):
     await state.set_state(TranslateText.translating)
     await message.answer("🌍 Введите текст для перевода на английский:", parse_mode="HTML")
@@ -372,13 +780,19 @@ async def process_translate_start(message: types.Message, state: FSMContext):
 @dp.message(TranslateText.translating)
 async def process_translate(message: types.Message, state: FSMContext):
     text_to_translate = message.text.strip()
-    translated = translator.translate(text_to_translate, dest='en')
-    save_query(message.from_user.id, message.from_user.username or str(message.from_user.id), "translate", text_to_translate)
-    await message.answer(f"🔠 Перевод: {translated.text}", parse_mode="HTML")
+    try:
+        translated = await translation_service.translate(text_to_translate, dest='en')
+    except Exception as e:
+        logger.warning(f"Переводчик недоступен: {e!r}")
+        await message.answer("⚠️ Переводчик сейчас недоступен, попробуйте позже.")
+        await state.clear()
+        return
+    await save_query(message.from_user.id, message.from_user.username or str(message.from_user.id), "translate", text_to_translate)
+    await message.answer(f"🔠 Перевод: {translated}", parse_mode="HTML")
     await state.clear()
 
 # Погода
-@dp.message(F.text == "🌤 Погода")
+@buttons.button("🌤 Погода")
 async def process_weather_start(message: types.Message, state: FSMContext):
     await state.set_state(WeatherCity.waiting_city)
     await message.answer("🌍 Введите название города:", parse_mode="HTML")
@@ -391,47 +805,35 @@ async def process_weather(message: types.Message, state: FSMContext):
     await state.clear()
 
 # Курс валют
-@dp.message(F.text == "💰 Курс валют")
+@buttons.button("💰 Курс валют")
 async def process_exchange_rate(message: types.Message):
-    url = "https://api.exchangerate-api.com/v4/latest/USD"
-    response = requests.get(url).json()
-    rates = response.get("rates", {})
-    
-    if rates:
-        uzs_rate = rates.get('UZS', 1)
-        currency_list = [
-            f"💵 1 USD = {round(rates.get('USD', 1) * uzs_rate, 2)} UZS",
-            f"💶 1 EUR = {round(rates.get('EUR', 1) * uzs_rate, 2)} UZS",
-            f"💷 1 GBP = {round(rates.get('GBP', 1) * uzs_rate, 2)} UZS",
-            f"💳 1 RUB = {round(rates.get('RUB', 1) * uzs_rate, 2)} UZS",
-            f"💴 1 UAH = {round(rates.get('UAH', 1) * uzs_rate, 2)} UZS"
-        ]
-        
-        await message.answer("💵 Курс валют относительно 1 UZS:\n" + "\n".join(currency_list))
+    rates_message = await rates_service.get_message()
+    if rates_message:
+        await message.answer(rates_message)
     else:
         await message.answer("❌ Не удалось загрузить курс валют.")
 
 # Дата и время
-@dp.message(F.text == "📅 Дата и время")
+@buttons.button("📅 Дата и время")
 async def process_datetime(message: types.Message):
     now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     await message.answer(f"📅 Текущая дата и время: {now}")
 
 # Случайное число
-@dp.message(F.text == "🎲 Случайное число")
+@buttons.button("🎲 Случайное число")
 async def process_random_number(message: types.Message):
     number = random.randint(1, 100)
     await message.answer(f"🎲 Ваше случайное число: {number}")
 
 # Местоположение
-@dp.message(F.text == "📍 Местоположение")
+@buttons.button("📍 Местоположение")
 async def process_location(message: types.Message):
     await message.answer("📍 Извините, но определение местоположения недоступно в этом боте.")
 
 # Моя статистика
-@dp.message(F.text == "📊 Моя статистика")
+@buttons.button("📊 Моя статистика")
 async def process_stats(message: types.Message):
-    stats = get_user_stats(message.from_user.id)
+    stats = await get_user_stats(message.from_user.id)
     if stats:
         stats_text = (f"📊 Ваша статистика:\n\n"
                      f"👤 Всего запросов: {stats[2]}\n"
@@ -443,39 +845,70 @@ async def process_stats(message: types.Message):
         await message.answer("📝 У вас пока нет статистики.", reply_markup=stats_kb)
 
 # История
-@dp.message(F.text == "📜 История")
+@buttons.button("📜 История")
 async def process_history(message: types.Message):
-    history = get_user_history(message.from_user.id)
-    if history:
-        history_text = "📜 Ваша история запросов:\n\n"
-        for query_type, query_text, timestamp in history:
-            history_text += f"🔹 {query_type}: {query_text}\n"
-            history_text += f"⏰ {timestamp}\n\n"
-        await message.answer(history_text, reply_markup=stats_kb)
-    else:
-        await message.answer("📝 У вас пока нет истории запросов.", reply_markup=stats_kb)
+    await send_user_list(message, "history", stats_kb)
 
 # Избранное
-@dp.message(F.text == "⭐️ Избранное")
+@buttons.button("⭐️ Избранное")
 async def process_favorites(message: types.Message):
-    favorites = get_favorites(message.from_user.id)
-    if favorites:
-        favorites_text = "⭐️ Ваши избранные запросы:\n\n"
-        for query_type, query_text, timestamp in favorites:
-            favorites_text += f"🔹 {query_type}: {query_text}\n"
-            favorites_text += f"⏰ {timestamp}\n\n"
-        await message.answer(favorites_text, reply_markup=favorites_kb)
-    else:
-        await message.answer("📝 У вас пока нет избранных запросов.", reply_markup=favorites_kb)
+    await send_user_list(message, "favorites", favorites_kb)
+
+# Замена страницы в сообщении; повторное нажатие на ту же страницу Telegram
+# отклоняет ошибкой "message is not modified" - это не ошибка
+async def edit_page(message: types.Message, text, reply_markup=None):
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in e.message:
+            raise
+
+# Листание истории и избранного
+@dp.callback_query(UserListPage.filter())
+async def callback_user_list_page(callback: types.CallbackQuery, callback_data: UserListPage):
+    try:
+        kind = callback_data.kind if callback_data.kind in USER_LISTS else "history"
+        rows, has_prev, has_next = await get_user_list_page(kind, callback.from_user.id,
+                                                            callback_data.direction or None, callback_data.cursor)
+        if not rows:
+            # Записи за курсором удалены - возвращаемся к началу списка
+            rows, has_prev, has_next = await get_user_list_page(kind, callback.from_user.id)
+        if rows:
+            text, keyboard = render_user_list_page(kind, rows, has_prev, has_next)
+            await edit_page(callback.message, text, keyboard)
+        else:
+            await edit_page(callback.message, USER_LISTS[kind][2])
+    finally:
+        # Без ответа у пользователя крутится индикатор на кнопке
+        await callback.answer()
+
+# Выгрузка всей истории: /export или /export csv
+EXPORT_FORMATS = ("jsonl", "csv")
+
+@dp.message(Command("export"))
+async def cmd_export(message: types.Message, command: CommandObject):
+    fmt = (command.args or EXPORT_FORMATS[0]).strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        await message.answer("❌ Использование: /export [jsonl|csv]")
+        return
+    path, count = await export_user_history(message.from_user.id, fmt)
+    try:
+        if count:
+            await message.answer_document(types.FSInputFile(path, filename=f"history.{fmt}"),
+                                          caption=f"📤 Ваша история: {count} запросов")
+        else:
+            await message.answer(USER_LISTS["history"][2])
+    finally:
+        os.remove(path)
 
 # Очистить историю
-@dp.message(F.text == "🗑 Очистить историю")
+@buttons.button("🗑 Очистить историю")
 async def process_clear_history(message: types.Message):
-    clear_user_history(message.from_user.id)
+    await clear_user_history(message.from_user.id)
     await message.answer("🗑 Ваша история запросов очищена.", reply_markup=stats_kb)
 
 # Добавить в избранное
-@dp.message(F.text == "➕ Добавить в избранное")
+@buttons.button("➕ Добавить в избранное")
 async def process_add_favorite_start(message: types.Message, state: FSMContext):
     await state.set_state(FavoriteManage.adding)
     await message.answer("💾 Введите запрос, который хотите добавить в избранное:", reply_markup=favorites_kb, parse_mode="HTML")
@@ -483,12 +916,12 @@ async def process_add_favorite_start(message: types.Message, state: FSMContext):
 @dp.message(FavoriteManage.adding)
 async def process_add_favorite(message: types.Message, state: FSMContext):
     query_text = message.text.strip()
-    add_to_favorites(message.from_user.id, "general", query_text)
+    await add_to_favorites(message.from_user.id, "general", query_text)
     await message.answer("✅ Запрос добавлен в избранное!", reply_markup=favorites_kb, parse_mode="HTML")
     await state.clear()
 
 # Удалить из избранного
-@dp.message(F.text == "➖ Удалить из избранного")
+@buttons.button("➖ Удалить из избранного")
 async def process_remove_favorite_start(message: types.Message, state: FSMContext):
     await state.set_state(FavoriteManage.removing)
     await message.answer("🗑 Введите запрос, который хотите удалить из избранного:", reply_markup=favorites_kb, parse_mode="HTML")
@@ -496,12 +929,12 @@ async def process_remove_favorite_start(message: types.Message, state: FSMContex
 @dp.message(FavoriteManage.removing)
 async def process_remove_favorite(message: types.Message, state: FSMContext):
     query_text = message.text.strip()
-    remove_from_favorites(message.from_user.id, query_text)
+    await remove_from_favorites(message.from_user.id, query_text)
     await message.answer("✅ Запрос удален из избранного!", reply_markup=favorites_kb, parse_mode="HTML")
     await state.clear()
 
 # Назад в главное меню
-@dp.message(F.text == "🔙 Назад в главное меню")
+@buttons.button("🔙 Назад в главное меню")
 async def process_back_to_menu(message: types.Message):
     await message.answer("Главное меню:", reply_markup=menu_kb)
 
@@ -509,29 +942,49 @@ async def process_back_to_menu(message: types.Message):
 @dp.message(Command("admin_stats"))
 async def cmd_admin_stats(message: types.Message):
     if message.from_user.id == ADMIN_ID:
-        conn = sqlite3.connect('bot_database.db')
-        c = conn.cursor()
-        c.execute('SELECT username, total_queries, wiki_queries, translate_queries FROM user_stats')
-        all_stats = c.fetchall()
-        conn.close()
-        
-        if all_stats:
-            stats_text = "📊 Статистика всех пользователей:\n\n"
-            for username, total, wiki, translate in all_stats:
-                stats_text += f"👤 {username}:\n"
-                stats_text += f"📚 Всего: {total}\n"
-                stats_text += f"🔍 Википедия: {wiki}\n"
-                stats_text += f"🔄 Переводы: {translate}\n\n"
-            await message.answer(stats_text)
+        rows, has_prev, has_next = await get_stats_page("total")
+        if rows:
+            stats_text, keyboard = render_stats_page("total", rows, has_prev, has_next)
+            await message.answer(stats_text, reply_markup=keyboard)
         else:
             await message.answer("📝 Пока нет статистики пользователей.")
     else:
         await message.answer("⛔️ У вас нет доступа к этой команде.")
 
+@dp.callback_query(AdminStatsPage.filter())
+async def callback_admin_stats_page(callback: types.CallbackQuery, callback_data: AdminStatsPage):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("⛔️ У вас нет доступа к этой команде.", show_alert=True)
+        return
+    try:
+        sort = callback_data.sort if callback_data.sort in STATS_SORTS else "total"
+        cursor = None
+        if callback_data.direction:
+            cursor = decode_stats_cursor(sort, callback_data.value, callback_data.user_id)
+        rows, has_prev, has_next = await get_stats_page(sort, callback_data.direction or None, cursor)
+        if rows:
+            stats_text, keyboard = render_stats_page(sort, rows, has_prev, has_next)
+            await edit_page(callback.message, stats_text, keyboard)
+    finally:
+        await callback.answer()
+
+@dp.callback_query(AdminStatsExport.filter())
+async def callback_admin_stats_export(callback: types.CallbackQuery):
+    if callback.from_user.id != ADMIN_ID:
+        await callback.answer("⛔️ У вас нет доступа к этой команде.", show_alert=True)
+        return
+    await callback.answer("📄 Готовлю выгрузку...")
+    path = await export_stats_csv()
+    try:
+        with send_priority(ADMIN):
+            await callback.message.answer_document(types.FSInputFile(path, filename="user_stats.csv"))
+    finally:
+        os.remove(path)
+
 @dp.message(Command("popular"))
 async def cmd_popular(message: types.Message):
     if message.from_user.id == ADMIN_ID:
-        popular = get_popular_queries()
+        popular = await get_popular_queries()
         if popular:
             popular_text = "🔥 Популярные запросы:\n\n"
             for query_text, count in popular:
@@ -542,19 +995,221 @@ async def cmd_popular(message: types.Message):
     else:
         await message.answer("⛔️ У вас нет доступа к этой команде.")
 
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: types.Message, command: CommandObject):
+    if message.from_user.id == ADMIN_ID:
+        if not command.args:
+            await message.answer("📣 Использование: /broadcast текст сообщения")
+            return
+        job_id = await broadcast_engine.start(command.args, message.chat.id)
+        await message.answer(f"📣 Рассылка #{job_id} запущена. Остановить: /broadcast_stop {job_id}")
+    else:
+        await message.answer("⛔️ У вас нет доступа к этой команде.")
+
+@dp.message(Command("broadcast_stop"))
+async def cmd_broadcast_stop(message: types.Message, command: CommandObject):
+    if message.from_user.id == ADMIN_ID:
+        if not command.args or not command.args.strip().isdigit():
+            running = ", ".join(f"#{job_id}" for job_id in broadcast_engine.running) or "нет"
+            await message.answer(f"📣 Использование: /broadcast_stop номер\nИдут рассылки: {running}")
+            return
+        if await broadcast_engine.cancel(int(command.args)):
+            await message.answer(f"🛑 Рассылка #{int(command.args)} остановлена.")
+        else:
+            await message.answer(f"❌ Рассылка #{int(command.args)} не идёт.")
+    else:
+        await message.answer("⛔️ У вас нет доступа к этой команде.")
+
+# /maintenance - проход обслуживания; /maintenance vacuum - ещё и перевод старой базы
+# в incremental auto_vacuum (полный VACUUM, запись в базу на это время останавливается)
+@dp.message(Command("maintenance"))
+async def cmd_maintenance(message: types.Message, command: CommandObject):
+    if message.from_user.id == ADMIN_ID:
+        convert = (command.args or "").strip().lower() == "vacuum"
+        await message.answer("🧹 Обслуживание базы запущено...")
+        report = await maintenance_job.run(convert=convert or None)
+        if report["converted"]:
+            vacuum_line = "\n🔹 Включён incremental auto_vacuum"
+        elif not report["incremental_vacuum"]:
+            vacuum_line = "\n🔹 incremental auto_vacuum не включён: /maintenance vacuum"
+        else:
+            vacuum_line = ""
+        await message.answer(f"🧹 Обслуживание базы завершено:\n\n"
+                             f"🔹 Свёрнуто записей истории: {report['rows_rolled_up']} ({report['batches']} пакетов)\n"
+                             f"🔹 Освобождено: {report['reclaimed_kb']} КБ\n"
+                             f"🔹 Размер базы: {report['size_kb']} КБ\n"
+                             f"🔹 Длительность: {report['duration_ms']} мс{vacuum_line}")
+    else:
+        await message.answer("⛔️ У вас нет доступа к этой команде.")
+
+@dp.message(Command("perf"))
+async def cmd_perf(message: types.Message):
+    if message.from_user.id == ADMIN_ID:
+        lines = ["⚙️ Внутренние показатели:", "", "⏱ Этапы (вызовов, p50 / p95 мс):"]
+        stages = REGISTRY.histogram_summary("bot_stage_seconds")
+        for labels, histogram in sorted(stages.items(), key=lambda item: -item[1].sum)[:15]:
+            lines.append(f"🔹 {labels[0][1]}: {histogram.count}, "
+                         f"{histogram.quantile(0.5) * 1000:.1f} / {histogram.quantile(0.95) * 1000:.1f}")
+        updates = {labels[0][1]: int(value) for (name, labels), value in REGISTRY.counters.items() if name == "bot_updates"}
+        in_flight = REGISTRY.gauges.get(("bot_updates_in_flight", ()), 0)
+        lines.extend(["", f"📨 Обновления: {updates}, в работе: {in_flight}"])
+        lines.extend(["", "📤 Исходящие сообщения:"])
+        lines.extend(f"🔹 {name}: {value}" for name, value in outbound_scheduler.stats().items())
+        lines.extend(["", "🗄 База данных (ожидание соединения):"])
+        lines.extend(f"🔹 {name}: {value}" for name, value in db.stats().items())
+        lines.extend(["", "🚀 Запуск (мс от старта процесса):"])
+        lines.extend(f"🔹 {name}: {value}" for name, value in STARTUP.stats().items())
+        lines.extend(["", "🧹 Обслуживание базы:"])
+        lines.extend(f"🔹 {name}: {value}" for name, value in maintenance_job.stats().items())
+        lines.extend(["", "📝 Буфер истории:"])
+        lines.extend(f"🔹 {name}: {value}" for name, value in history_writer.stats().items())
+        lines.extend(["", "🔐 Кэш подписок:"])
+        lines.extend(f"🔹 {name}: {value}" for name, value in subscription_cache.stats().items())
+        lines.extend(f"🔹 {name}: {value}" for name, value in subscription_flight.stats().items())
+        lines.extend(["", "📚 Кэш Википедии:"])
+        lines.extend(f"🔹 {name}: {value}" for name, value in wiki_service.stats().items())
+        lines.extend(["", "🔎 Inline-поиск:"])
+        lines.extend(f"🔹 {name}: {value}" for name, value in wiki_service.search_stats().items())
+        lines.extend(f"🔹 debounce_{name}: {value}" for name, value in inline_debouncer.stats().items())
+        lines.extend(["", "🈹 Переводчик:"])
+        lines.extend(f"🔹 {name}: {value}" for name, value in translation_service.stats().items())
+        lines.extend(["", "💰 Курс валют:"])
+        lines.extend(f"🔹 {name}: {value}" for name, value in rates_service.stats().items())
+        lines.extend(["", "🛡 Внешние сервисы:"])
+        for upstream in upstreams:
+            stats = upstream.stats()
+            lines.append(f"🔹 {upstream.name}: {stats['state']}, вызовов {stats['calls']}, ошибок {stats['failures']} "
+                         f"(таймаутов {stats['timeouts']}), отклонено {stats['rejected']}, "
+                         f"дублей {stats['hedged']} (выиграли {stats['hedge_wins']})")
+        if isinstance(fsm_storage, CachedStorage):
+            lines.extend(["", "🗂 Кэш состояний FSM:"])
+            lines.extend(f"🔹 {name}: {value}" for name, value in fsm_storage.stats().items())
+        await message.answer("\n".join(lines))
+    else:
+        await message.answer("⛔️ У вас нет доступа к этой команде.")
+
+# Кнопки клавиатур - после всех обработчиков состояний
+buttons.register(dp.message)
+
 # Обработчик для всех остальных сообщений
 @dp.message()
 async def process_other_messages(message: types.Message):
     await message.answer("Не понимаю эту команду. Используйте клавиатуру или /help для просмотра доступных команд.")
 
+metrics_runner = None
+warmup_task = None
+
+# Фоновое создание ленивых клиентов, когда бот уже принимает обновления
+async def warm_clients(delay):
+    await asyncio.sleep(delay)
+    for name, client in (("googletrans", translator), ("wikipediaapi", wiki_wiki)):
+        try:
+            await client.warm()
+        except Exception as e:
+            logger.warning(f"Не удалось заранее создать клиент {name}: {e}")
+            continue
+        STARTUP.extra[f"{name}_init_ms"] = round(client.init_seconds * 1000, 1)
+
+# Запуск и остановка фоновых служб процесса, который обрабатывает обновления
+async def start_services(resume_broadcasts=True, metrics_port=METRICS_PORT, maintenance=True):
+    global metrics_runner, warmup_task
+    if metrics_port:
+        metrics_runner = await start_metrics_server(METRICS_HOST, metrics_port)
+    # Инициализация базы данных
+    await init_db()
+    history_writer.start()
+    await rates_service.start()
+    if resume_broadcasts:
+        broadcast_engine.watch()
+    if maintenance:
+        maintenance_job.start()
+    if CLIENT_WARMUP_DELAY >= 0:
+        warmup_task = asyncio.create_task(warm_clients(CLIENT_WARMUP_DELAY))
+    STARTUP.mark("services")
+
+async def stop_services():
+    # Рассылки продолжатся с сохранённого места при следующем запуске
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await broadcast_engine.stop()
+    await maintenance_job.stop()
+    # Дописываем накопленную историю перед выходом
+    await history_writer.stop()
+    await rates_service.stop()
+    await outbound_scheduler.close()
+    db.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+# Воркер шардированного режима (отдельный процесс)
+def run_worker(index, updates, heartbeats):
+    async def worker():
+        # Незавершённые рассылки и обслуживание базы - только в воркере 0
+        await start_services(resume_broadcasts=index == 0, maintenance=index == 0,
+                             metrics_port=METRICS_PORT + 1 + index if METRICS_PORT else 0)
+        logger.info(f"Воркер {index} запущен")
+        try:
+            await process_shard(updates, lambda update: dp.feed_raw_update(bot, update), heartbeats, index)
+        finally:
+            await stop_services()
+            await bot.session.close()
+            logger.info(f"Воркер {index} остановлен")
+    # У каждого воркера свой файл журнала: ротация одного файла из нескольких процессов небезопасна
+    if LOG_FILE:
+        name, ext = os.path.splitext(LOG_FILE)
+        configure_logging(f"{name}.worker{index}{ext}")
+    # Сигналы остановки получает вся группа процессов (Ctrl+C, SIGTERM от Heroku), но воркер
+    # останавливает фронтовой процесс через None в очереди - так буфер истории успевает записаться
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(worker())
+
+# Фронтовой процесс: только принимает обновления и раздаёт их воркерам
+async def run_sharded():
+    await init_db()
+    runner = ShardedRunner(run_worker, WORKERS, health_interval=WORKER_HEALTH_INTERVAL,
+                           heartbeat_timeout=WORKER_HEARTBEAT_TIMEOUT)
+    runner.start()
+    logger.info(f"Бот запущен, воркеров: {WORKERS}")
+    STARTUP.mark("ready")
+    try:
+        if RUN_MODE == "webhook":
+            await run_webhook(dp, bot, url=WEBHOOK_URL, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                              host=WEBAPP_HOST, port=WEBAPP_PORT, allowed_updates=dp.resolve_used_update_types(),
+                              drain_timeout=WEBHOOK_DRAIN_TIMEOUT, drain_grace=WEBHOOK_DRAIN_GRACE, feed=runner.dispatch)
+        else:
+            await bot.delete_webhook()
+            await poll_updates(bot, runner.dispatch, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        await runner.stop()
+        await bot.session.close()
+        db.close()
+
+STARTUP.mark("init")
+
 # Запуск бота
 async def main():
-    # Инициализация базы данных
-    init_db()
+    # Без секрета любой, кто узнал адрес вебхука, может прислать поддельные обновления
+    if RUN_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise ValueError("Для RUN_MODE=webhook нужен WEBHOOK_SECRET")
+    if WORKERS > 1:
+        await run_sharded()
+        return
+
+    await start_services()
     logger.info("Бот запущен")
+    STARTUP.mark("ready")
     
     # Запуск бота
-    await dp.start_polling(bot)
+    try:
+        if RUN_MODE == "webhook":
+            await run_webhook(dp, bot, url=WEBHOOK_URL, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                              host=WEBAPP_HOST, port=WEBAPP_PORT, allowed_updates=dp.resolve_used_update_types(),
+                              drain_timeout=WEBHOOK_DRAIN_TIMEOUT, drain_grace=WEBHOOK_DRAIN_GRACE)
+        else:
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        await stop_services()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,185 @@
+import asyncio
+import datetime
+import logging
+import time
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+SELECT_EXPIRED = 'SELECT id FROM query_history WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?'
+
+ROLLUP_DAILY = '''INSERT INTO query_daily (day, user_id, query_type, count)
+                  SELECT date(timestamp), user_id, query_type, COUNT(*) FROM query_history
+                  WHERE id IN ({ids}) GROUP BY 1, 2, 3
+                  ON CONFLICT(day, user_id, query_type) DO UPDATE SET count = count + excluded.count'''
+
+
+# Обслуживание базы: сырые записи query_history старше retention_days
+# сворачиваются в дневные счётчики query_daily (день, пользователь, тип) и
+# удаляются небольшими пакетами - каждый пакет отдельной короткой транзакцией,
+# чтобы не задерживать запись истории. Затем освободившиеся страницы
+# возвращаются файловой системе (incremental_vacuum) и обновляется статистика
+# планировщика (ANALYZE). Базу, созданную до incremental auto_vacuum, в этот
+# режим переводит только полный VACUUM: он занимает соединение-писатель на всё
+# время перестройки файла, поэтому выполняется лишь по запросу (run(convert=True),
+# команда /maintenance vacuum) или, если задан convert_auto_vacuum, в плановом
+# проходе. Без перевода incremental_vacuum для такой базы пропускается. query_counts и user_stats при этом не меняются,
+# поэтому /popular и статистика пользователей остаются верными.
+class MaintenanceJob:
+    def __init__(self, db, retention_days=90, interval=24 * 3600, batch_size=500, vacuum_pages=1000,
+                 initial_delay=60.0, convert_auto_vacuum=False):
+        self.db = db
+        self.retention_days = retention_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.initial_delay = initial_delay
+        self.convert_auto_vacuum = convert_auto_vacuum
+        self._task = None
+        self._lock = asyncio.Lock()
+        # Итоги для /perf и /maintenance
+        self.runs = 0
+        self.failures = 0
+        self.rows_rolled_up = 0
+        self.reclaimed_bytes = 0
+        self.last_report = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        await asyncio.sleep(self.initial_delay)
+        while True:
+            try:
+                await self.run()
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Ошибка обслуживания базы: {e}")
+            await asyncio.sleep(self.interval)
+
+    # Один проход обслуживания; возвращает отчёт (его же пишет в журнал).
+    # convert - перевести базу в incremental auto_vacuum полным VACUUM, если нужно
+    async def run(self, convert=None):
+        if convert is None:
+            convert = self.convert_auto_vacuum
+        async with self._lock:
+            with timed("db.maintenance"):
+                return await self._run_once(convert)
+
+    async def _run_once(self, convert):
+        started = time.perf_counter()
+        size_before = await self.db.read(self._database_size)
+        rolled_up = batches = 0
+        if self.retention_days > 0:
+            # Граница по началу суток (UTC, как и timestamp), чтобы дневные счётчики не дробились
+            cutoff = (datetime.datetime.now(datetime.timezone.utc).date()
+                      - datetime.timedelta(days=self.retention_days)).strftime("%Y-%m-%d 00:00:00")
+            while True:
+                deleted = await self.db.transaction(self._rollup_batch, cutoff, self.batch_size)
+                if not deleted:
+                    break
+                rolled_up += deleted
+                batches += 1
+                # Даём обработчикам записать своё между пакетами
+                await asyncio.sleep(0)
+        converted = False
+        if convert:
+            converted = await self.db.transaction(self._enable_incremental_vacuum)
+            if converted:
+                logger.info("Обслуживание базы: включён incremental auto_vacuum (выполнен полный VACUUM)")
+        while await self.db.transaction(self._vacuum_step, self.vacuum_pages):
+            await asyncio.sleep(0)
+        await self.db.transaction(self._analyze)
+        size_after = await self.db.read(self._database_size)
+        incremental = await self.db.read(self._is_incremental)
+
+        report = {
+            "rows_rolled_up": rolled_up,
+            "batches": batches,
+            "reclaimed_kb": round(max(0, size_before - size_after) / 1024, 1),
+            "size_kb": round(size_after / 1024, 1),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "finished_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "converted": converted,
+            "incremental_vacuum": incremental,
+        }
+        self.runs += 1
+        self.rows_rolled_up += rolled_up
+        self.reclaimed_bytes += max(0, size_before - size_after)
+        self.last_report = report
+        logger.info(f"Обслуживание базы: свёрнуто {rolled_up} записей истории за {batches} пакетов, "
+                    f"освобождено {report['reclaimed_kb']} КБ, размер {report['size_kb']} КБ, "
+                    f"длительность {report['duration_ms']} мс")
+        if not incremental:
+            logger.info("Обслуживание базы: incremental auto_vacuum не включён, место не возвращается; "
+                        "перевести базу - /maintenance vacuum (полный VACUUM)")
+        return report
+
+    @staticmethod
+    def _database_size(conn):
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+
+    @staticmethod
+    def _rollup_batch(conn, cutoff, batch_size):
+        ids = [row[0] for row in conn.execute(SELECT_EXPIRED, (cutoff, batch_size))]
+        if not ids:
+            return 0
+        placeholders = ",".join("?" * len(ids))
+        conn.execute(ROLLUP_DAILY.format(ids=placeholders), ids)
+        conn.execute(f'DELETE FROM query_history WHERE id IN ({placeholders})', ids)
+        return len(ids)
+
+    @staticmethod
+    def _is_incremental(conn):
+        return conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+    # Однократный перевод существующей базы; True, если VACUUM выполнялся
+    @staticmethod
+    def _enable_incremental_vacuum(conn):
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+
+    # Возвращает True, пока в файле остаются свободные страницы
+    @staticmethod
+    def _vacuum_step(conn, pages):
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return False
+        if not conn.execute("PRAGMA freelist_count").fetchone()[0]:
+            return False
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        return conn.execute("PRAGMA freelist_count").fetchone()[0] > 0
+
+    @staticmethod
+    def _analyze(conn):
+        # Ограничиваем выборку, чтобы ANALYZE не читал большие таблицы целиком
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("ANALYZE")
+
+    def stats(self):
+        stats = {
+            "runs": self.runs,
+            "failures": self.failures,
+            "rows_rolled_up": self.rows_rolled_up,
+            "reclaimed_kb": round(self.reclaimed_bytes / 1024, 1),
+        }
+        if self.last_report is not None:
+            stats.update(last_duration_ms=self.last_report["duration_ms"],
+                         last_reclaimed_kb=self.last_report["reclaimed_kb"],
+                         last_run=self.last_report["finished_at"])
+        return stats
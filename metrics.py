@@ -0,0 +1,216 @@
+import bisect
+import contextvars
+import functools
+import logging
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+from logs import set_log_field
+
+logger = logging.getLogger(__name__)
+# Строка на каждое обработанное обновление (с latency_ms в контексте журнала)
+update_logger = logging.getLogger("metrics.updates")
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Этапы текущего обновления (для журнала медленных обновлений)
+current_stages = contextvars.ContextVar("update_stages", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Оценка квантиля по корзинам (линейная интерполяция внутри корзины)
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{str(value)}"' for key, value in labels) + "}"
+
+
+# Реестр метрик процесса: счётчики, гистограммы, текущие значения и
+# "сборщики" - функции stats() служб, которые экспортируются как gauge
+class Registry:
+    def __init__(self):
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = {}
+
+    def inc(self, name, labels=(), value=1):
+        self.counters[(name, labels)] += value
+
+    def set(self, name, labels=(), value=0):
+        self.gauges[(name, labels)] = value
+
+    def add(self, name, labels=(), value=1):
+        self.gauges[(name, labels)] = self.gauges.get((name, labels), 0) + value
+
+    def observe(self, name, labels=(), value=0.0):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[(name, labels)] = Histogram()
+        histogram.observe(value)
+
+    def collector(self, prefix, fn):
+        self.collectors[prefix] = fn
+
+    def histogram_summary(self, name):
+        return {labels: histogram for (metric, labels), histogram in self.histograms.items() if metric == name}
+
+    # Текстовый формат Prometheus
+    def render(self):
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{name}_total{_labels(labels)} {value:g}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets_with_inf(histogram), histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram.sum:g}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+        for prefix, fn in sorted(self.collectors.items()):
+            try:
+                stats = fn()
+            except Exception as e:
+                logger.warning(f"Сборщик метрик {prefix} завершился с ошибкой: {e}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if isinstance(value, (int, float)):
+                    lines.append(f"bot_{prefix}_{key} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def buckets_with_inf(histogram):
+        return [f"{bound:g}" for bound in histogram.buckets] + ["+Inf"]
+
+
+REGISTRY = Registry()
+
+
+# Замер этапа: контекстный менеджер (with / async with) или декоратор корутины.
+# Время попадает в гистограмму bot_stage_seconds{stage=...} и в разбивку
+# текущего обновления для журнала медленных обновлений.
+class timed:
+    def __init__(self, stage, registry=REGISTRY):
+        self.stage = stage
+        self.registry = registry
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started
+        self.registry.observe("bot_stage_seconds", (("stage", self.stage),), elapsed)
+        if exc_type is not None:
+            self.registry.inc("bot_stage_errors", (("stage", self.stage),))
+        stages = current_stages.get()
+        if stages is not None:
+            stages.append((self.stage, elapsed))
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with timed(self.stage, self.registry):
+                return await fn(*args, **kwargs)
+        return wrapper
+
+
+# Outer-middleware диспетчера: число обновлений по типам, обновления в работе,
+# общее время обработки и строка журнала на каждое обновление с latency_ms;
+# медленные обновления пишутся с уровнем WARNING и разбивкой по этапам.
+# Должен стоять внутри LogContextMiddleware, чтобы запись получила контекст.
+class UpdateMetricsMiddleware:
+    def __init__(self, registry=REGISTRY, slow_threshold=0.0):
+        self.registry = registry
+        self.slow_threshold = slow_threshold
+
+    async def __call__(self, handler, event, data):
+        update_type = event.event_type
+        stages = []
+        token = current_stages.set(stages)
+        self.registry.inc("bot_updates", (("type", update_type),))
+        self.registry.add("bot_updates_in_flight", (), 1)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.registry.add("bot_updates_in_flight", (), -1)
+            self.registry.observe("bot_update_seconds", (("type", update_type),), elapsed)
+            current_stages.reset(token)
+            set_log_field("latency_ms", round(elapsed * 1000, 1))
+            if self.slow_threshold and elapsed >= self.slow_threshold:
+                breakdown = ", ".join(f"{stage}={seconds * 1000:.0f}мс" for stage, seconds in stages) or "нет данных"
+                update_logger.warning(f"Медленное обновление {event.update_id} ({update_type}) "
+                                      f"{elapsed * 1000:.0f} мс: {breakdown}")
+            else:
+                update_logger.info(f"Обновление {event.update_id} ({update_type}) обработано за "
+                                   f"{elapsed * 1000:.0f} мс")
+
+
+# Inner-middleware: время работы каждого обработчика.
+# Кнопки клавиатур проходят через один общий обработчик (buttons.ButtonRouter),
+# поэтому для них берётся настоящий обработчик кнопки из data["button"].
+class HandlerMetricsMiddleware:
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("button") or data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        set_log_field("handler", name)
+        with timed(f"handler.{name}", self.registry):
+            return await handler(event, data)
+
+
+# Отдельный HTTP-сервер с /metrics в текстовом формате Prometheus
+async def start_metrics_server(host, port, registry=REGISTRY):
+    async def handle(request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
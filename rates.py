@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from metrics import timed
+from resilience import Upstream
+
+logger = logging.getLogger(__name__)
+
+CURRENCIES = (("💵", "USD"), ("💶", "EUR"), ("💷", "GBP"), ("💳", "RUB"), ("💴", "UAH"))
+
+
+# Готовое сообщение с курсами, None если курсов нет
+def format_rates(rates):
+    if not rates:
+        return None
+    uzs_rate = rates.get('UZS', 1)
+    currency_list = [f"{icon} 1 {code} = {round(rates.get(code, 1) * uzs_rate, 2)} UZS" for icon, code in CURRENCIES]
+    return "💵 Курс валют относительно 1 UZS:\n" + "\n".join(currency_list)
+
+
+# Курсы валют из памяти: таблица обновляется в фоне раз в refresh_interval
+# секунд через общую aiohttp-сессию, сообщение форматируется один раз на
+# обновление. Если источник медленный или недоступен, отдаём последний
+# снимок (stale-while-revalidate) и пробуем обновить его в фоне; пока
+# выключатель upstream разомкнут, обновление не ждёт источник вовсе.
+class RatesService:
+    def __init__(self, url, refresh_interval=600, timeout=10, upstream=None):
+        self.url = url
+        self.upstream = upstream or Upstream("exchange_rates", timeout=timeout)
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+        self.message = None
+        self.updated_at = 0.0
+        self.refreshes = 0
+        self.failures = 0
+        self._session = None
+        self._task = None
+        self._refreshing = None
+
+    @property
+    def age(self):
+        return time.monotonic() - self.updated_at if self.message is not None else None
+
+    async def start(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        await self.refresh()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in (self._task, self._refreshing):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._refreshing = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+    # Одно обновление за раз: параллельные вызовы ждут уже идущее
+    async def refresh(self):
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        return await asyncio.shield(self._refreshing)
+
+    async def _refresh(self):
+        try:
+            with timed("external.exchange_rates"):
+                data = await self.upstream.call(self._fetch)
+            message = format_rates(data.get("rates", {}))
+            if message is None:
+                raise ValueError("в ответе нет курсов")
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Не удалось обновить курс валют: {e!r}")
+            return False
+        self.message = message
+        self.updated_at = time.monotonic()
+        self.refreshes += 1
+        return True
+
+    async def _fetch(self):
+        async with self._session.get(self.url) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def get_message(self):
+        if self.message is None:
+            # Снимка ещё нет - придётся подождать источник
+            await self.refresh()
+        elif self.age > self.refresh_interval * 2 and (self._refreshing is None or self._refreshing.done()):
+            # Снимок устарел (фоновое обновление не удаётся) - отдаём его и обновляем в фоне
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        return self.message
+
+    def stats(self):
+        return {
+            "age_s": round(self.age, 1) if self.age is not None else None,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+        }
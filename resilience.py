@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+# Вызов отклонён без обращения к сервису: автомат разомкнут
+class CircuitOpenError(Exception):
+    def __init__(self, name):
+        super().__init__(f"{name}: сервис временно недоступен")
+        self.name = name
+
+
+# Автоматический выключатель: после failure_threshold ошибок подряд вызовы
+# reset_timeout секунд отклоняются сразу, затем пропускается один пробный
+# вызов - успех замыкает цепь, ошибка размыкает снова
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._trial = False
+
+    def allow(self):
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            self._trial = False
+        if self.state == HALF_OPEN:
+            if self._trial:
+                return False
+            self._trial = True
+        return True
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logger.info(f"{self.name}: сервис снова отвечает, цепь замкнута")
+        self.state = CLOSED
+        self.failures = 0
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.opens += 1
+                logger.warning(f"{self.name}: {self.failures} ошибок подряд, вызовы отклоняются "
+                               f"{self.reset_timeout:g} с")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self._trial = False
+
+    # Пробный вызов отменён без результата - следующий вызов станет пробным
+    def release(self):
+        if self.state == HALF_OPEN:
+            self._trial = False
+
+    def stats(self):
+        return {"state": self.state, "open": self.state != CLOSED, "consecutive_failures": self.failures,
+                "opens": self.opens}
+
+
+# Защищённый вызов внешнего сервиса: общий срок (timeout) на вызов целиком,
+# автоматический выключатель и, если задан hedge_after, дублирующий запрос,
+# когда первый не ответил за hedge_after секунд (берётся первый успешный ответ).
+# Дублировать можно только идемпотентные запросы на чтение.
+# Исключения из ignore - ответы сервиса (например, "нет такого пользователя"),
+# они не считаются отказом.
+class Upstream:
+    def __init__(self, name, timeout=None, failure_threshold=5, reset_timeout=30.0, hedge_after=None, ignore=()):
+        self.name = name
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.ignore = tuple(ignore)
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    # fn(*args) должна возвращать новую корутину на каждый вызов
+    async def call(self, fn, *args):
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError(self.name)
+        self.calls += 1
+        done = False
+        try:
+            if self.hedge_after:
+                result = await asyncio.wait_for(self._hedged(fn, args), self.timeout)
+            else:
+                result = await asyncio.wait_for(fn(*args), self.timeout)
+            done = True
+        except self.ignore:
+            done = True
+            self.breaker.record_success()
+            raise
+        except asyncio.TimeoutError:
+            done = True
+            self.timeouts += 1
+            self.failures += 1
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            done = True
+            self.failures += 1
+            self.breaker.record_failure()
+            raise
+        finally:
+            if not done:
+                self.breaker.release()
+        self.breaker.record_success()
+        return result
+
+    async def _hedged(self, fn, args):
+        tasks = [asyncio.ensure_future(fn(*args))]
+        try:
+            finished, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if finished:
+                return tasks[0].result()
+            self.hedged += 1
+            tasks.append(asyncio.ensure_future(fn(*args)))
+            pending = set(tasks)
+            while True:
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    if task.exception() is None:
+                        if task is tasks[1]:
+                            self.hedge_wins += 1
+                        return task.result()
+                if not pending:
+                    # Оба запроса упали - отдаём ошибку последнего
+                    return task.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self):
+        stats = self.breaker.stats()
+        stats.update(calls=self.calls, failures=self.failures, timeouts=self.timeouts, rejected=self.rejected,
+                     hedged=self.hedged, hedge_wins=self.hedge_wins)
+        return stats
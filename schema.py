@@ -0,0 +1,123 @@
+# Миграции схемы базы данных. Номер версии хранится в PRAGMA user_version;
+# init_db() применяет все миграции после текущей версии по порядку.
+# Новые изменения схемы добавляются только в конец списка.
+
+
+# Страниц, до которых база считается новой: VACUUM для неё занимает миллисекунды
+SMALL_DB_PAGES = 1000
+
+
+# auto_vacuum меняется только полным VACUUM, а VACUUM не работает внутри транзакции.
+# На большой базе он идёт минутами, поэтому при запуске переводится только новая база,
+# а существующую переводит фоновое обслуживание (maintenance.py)
+def _enable_incremental_vacuum(conn):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    if conn.execute("PRAGMA page_count").fetchone()[0] <= SMALL_DB_PAGES:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+
+MIGRATIONS = [
+    # 1: исходные таблицы
+    '''
+    -- Таблица истории запросов
+    CREATE TABLE IF NOT EXISTS query_history
+             (id INTEGER PRIMARY KEY AUTOINCREMENT,
+              user_id INTEGER,
+              username TEXT,
+              query_type TEXT,
+              query_text TEXT,
+              timestamp DATETIME DEFAULT CURRENT_TIMESTAMP);
+    -- Таблица избранных запросов
+    CREATE TABLE IF NOT EXISTS favorites
+             (id INTEGER PRIMARY KEY AUTOINCREMENT,
+              user_id INTEGER,
+              query_type TEXT,
+              query_text TEXT,
+              timestamp DATETIME DEFAULT CURRENT_TIMESTAMP);
+    -- Таблица статистики пользователей
+    CREATE TABLE IF NOT EXISTS user_stats
+             (user_id INTEGER PRIMARY KEY,
+              username TEXT,
+              total_queries INTEGER DEFAULT 0,
+              wiki_queries INTEGER DEFAULT 0,
+              translate_queries INTEGER DEFAULT 0,
+              last_active DATETIME DEFAULT CURRENT_TIMESTAMP);
+    -- Кэш кратких содержаний статей Википедии (summary = NULL - статья не найдена)
+    CREATE TABLE IF NOT EXISTS wiki_cache
+             (title_key TEXT PRIMARY KEY,
+              summary TEXT,
+              fetched_at REAL);
+    ''',
+    # 2: индексы под выборки по пользователю и счётчики популярных запросов
+    '''
+    CREATE INDEX IF NOT EXISTS idx_history_user_time ON query_history (user_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_favorites_user_time ON favorites (user_id, timestamp);
+    CREATE INDEX IF NOT EXISTS idx_favorites_user_text ON favorites (user_id, query_text);
+    -- Число запросов по тексту, обновляется при каждой записи истории
+    CREATE TABLE IF NOT EXISTS query_counts
+             (query_text TEXT PRIMARY KEY,
+              count INTEGER NOT NULL DEFAULT 0);
+    CREATE INDEX IF NOT EXISTS idx_query_counts_count ON query_counts (count);
+    INSERT OR REPLACE INTO query_counts (query_text, count)
+        SELECT query_text, COUNT(*) FROM query_history WHERE query_text IS NOT NULL GROUP BY query_text;
+    ''',
+    # 3: индексы для постраничной статистики администратора
+    '''
+    CREATE INDEX IF NOT EXISTS idx_user_stats_total ON user_stats (total_queries, user_id);
+    CREATE INDEX IF NOT EXISTS idx_user_stats_active ON user_stats (last_active, user_id);
+    ''',
+    # 4: состояния FSM (ключ "бот:чат:пользователь:...", данные в JSON)
+    '''
+    CREATE TABLE IF NOT EXISTS fsm_state
+             (key TEXT PRIMARY KEY,
+              state TEXT,
+              data TEXT,
+              expires_at REAL NOT NULL);
+    CREATE INDEX IF NOT EXISTS idx_fsm_state_expires ON fsm_state (expires_at);
+    ''',
+    # 5: рассылки с сохранением прогресса и недоступные пользователи
+    '''
+    CREATE TABLE IF NOT EXISTS broadcasts
+             (id INTEGER PRIMARY KEY AUTOINCREMENT,
+              text TEXT NOT NULL,
+              status TEXT NOT NULL DEFAULT 'running',
+              last_user_id INTEGER NOT NULL DEFAULT 0,
+              sent INTEGER NOT NULL DEFAULT 0,
+              blocked INTEGER NOT NULL DEFAULT 0,
+              failed INTEGER NOT NULL DEFAULT 0,
+              admin_chat_id INTEGER,
+              progress_message_id INTEGER,
+              created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+              finished_at DATETIME);
+    CREATE TABLE IF NOT EXISTS blocked_users
+             (user_id INTEGER PRIMARY KEY,
+              reason TEXT,
+              blocked_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+    ''',
+    # 6: дневные счётчики запросов, в которые сворачивается старая история (maintenance.py)
+    '''
+    CREATE TABLE IF NOT EXISTS query_daily
+             (day TEXT NOT NULL,
+              user_id INTEGER NOT NULL,
+              query_type TEXT NOT NULL,
+              count INTEGER NOT NULL DEFAULT 0,
+              PRIMARY KEY (day, user_id, query_type)) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_history_time ON query_history (timestamp);
+    ''',
+    # 7: incremental auto_vacuum, чтобы освобождённое место возвращалось без полного VACUUM
+    _enable_incremental_vacuum,
+    # 8: постраничные история и избранное с курсором по id вместо сортировки по времени
+    '''
+    CREATE INDEX IF NOT EXISTS idx_history_user_id ON query_history (user_id, id);
+    CREATE INDEX IF NOT EXISTS idx_favorites_user_id ON favorites (user_id, id);
+    DROP INDEX IF EXISTS idx_history_user_time;
+    DROP INDEX IF EXISTS idx_favorites_user_time;
+    ''',
+    # 9: владелец рассылки и срок его аренды, чтобы при общей базе рассылку вёл один процесс
+    '''
+    ALTER TABLE broadcasts ADD COLUMN owner TEXT;
+    ALTER TABLE broadcasts ADD COLUMN lease_until REAL;
+    ''',
+]
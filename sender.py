@@ -0,0 +1,190 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Очереди приоритетов: меньше - раньше
+INTERACTIVE = 0  # ответы пользователям
+ADMIN = 1        # сообщения администратору
+BULK = 2         # массовые рассылки
+LANES = {INTERACTIVE: "interactive", ADMIN: "admin", BULK: "bulk"}
+
+current_priority = contextvars.ContextVar("send_priority", default=INTERACTIVE)
+
+# Методы, которые создают или меняют сообщения в чате и попадают под лимиты Telegram
+SHAPED_PREFIXES = ("Send", "Copy", "Forward", "EditMessage")
+
+
+# Все отправки внутри блока идут в указанной очереди приоритета
+@contextmanager
+def send_priority(lane):
+    token = current_priority.set(lane)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+# Корзина токенов с резервированием: reserve() сразу занимает токен
+# и возвращает, сколько секунд нужно подождать до его появления
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(delay, self.blocked_until - now)
+
+    def pause(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    @property
+    def idle(self):
+        now = time.monotonic()
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+# Планировщик исходящих сообщений (middleware сессии бота).
+# Обработчики вызывают message.answer()/bot.send_message() как раньше, а каждый
+# запрос отправки сначала ждёт токен своего чата (личные чаты ~1 сообщение/с,
+# группы ~20 в минуту), затем общий токен (~30 сообщений/с), который выдаётся
+# по приоритету очереди. На 429 чат ставится на паузу retry_after и запрос повторяется.
+# Если 429 пришёл на рассылку или за flood_window секунд его получили flood_chats
+# разных чатов, Telegram ограничивает бота целиком - на паузу встаёт и общая корзина.
+class OutboundScheduler(BaseRequestMiddleware):
+    def __init__(self, global_rate=30.0, private_rate=1.0, group_rate=20 / 60, chat_burst=3,
+                 max_retries=3, max_chats=10000, flood_window=1.0, flood_chats=3):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.flood_window = flood_window
+        self.flood_chats = flood_chats
+        self._floods = deque()
+        self._chats = {}
+        self._queue = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._task = None
+        self.sent = 0
+        self.retries = 0
+        self.global_pauses = 0
+        self.wait_count = {lane: 0 for lane in LANES}
+        self.wait_total = {lane: 0.0 for lane in LANES}
+        self.wait_max = {lane: 0.0 for lane in LANES}
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not type(method).__name__.startswith(SHAPED_PREFIXES):
+            return await make_request(bot, method)
+        lane = current_priority.get()
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, lane)
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                logger.warning(f"Flood control для чата {chat_id}, повтор через {e.retry_after} с")
+                self._chat_bucket(chat_id).pause(e.retry_after)
+                self._on_flood(chat_id, lane, e.retry_after)
+                continue
+            self.sent += 1
+            return result
+
+    def _on_flood(self, chat_id, lane, retry_after):
+        now = time.monotonic()
+        self._floods.append((now, chat_id))
+        while self._floods and now - self._floods[0][0] > self.flood_window:
+            self._floods.popleft()
+        chats = len({flood_chat for _, flood_chat in self._floods})
+        if lane == BULK or chats >= self.flood_chats:
+            if self.global_bucket.blocked_until < now + retry_after:
+                self.global_pauses += 1
+                logger.warning(f"Flood control для всего бота ({LANES[lane]}, чатов с 429: {chats}), "
+                               f"отправки приостановлены на {retry_after} с")
+            self.global_bucket.pause(retry_after)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                # Забываем чаты, которые давно ничего не отправляли
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(self.group_rate if is_group else self.private_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, chat_id, lane):
+        started = time.monotonic()
+        delay = self._chat_bucket(chat_id).reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._ensure_running()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (lane, next(self._seq), future))
+        self._wakeup.set()
+        await future
+        waited = time.monotonic() - started
+        self.wait_count[lane] += 1
+        self.wait_total[lane] += waited
+        self.wait_max[lane] = max(self.wait_max[lane], waited)
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    # Выдача общих токенов: первым получает запрос с наивысшим приоритетом
+    async def _run(self):
+        while True:
+            while not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            delay = self.global_bucket.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            while self._queue:
+                _, _, future = heapq.heappop(self._queue)
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        stats = {"queue_depth": len(self._queue), "sent": self.sent, "retries": self.retries,
+                 "global_pauses": self.global_pauses, "chats": len(self._chats)}
+        for lane, name in LANES.items():
+            count = self.wait_count[lane]
+            stats[f"{name}_avg_wait_ms"] = round(self.wait_total[lane] / count * 1000, 1) if count else 0.0
+            stats[f"{name}_max_wait_ms"] = round(self.wait_max[lane] * 1000, 1)
+        return stats
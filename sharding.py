@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Пользователь, к которому относится обновление (сырой dict из Bot API).
+# В chat_member и my_chat_member это участник, чей статус изменился, а не
+# администратор в "from": кэш подписки участника живёт в его шарде
+def update_user_id(update):
+    for key, payload in update.items():
+        if isinstance(payload, dict):
+            member = payload.get("new_chat_member")
+            if isinstance(member, dict) and isinstance(member.get("user"), dict) and "id" in member["user"]:
+                return member["user"]["id"]
+            sender = payload.get("from") or payload.get("user")
+            if isinstance(sender, dict) and "id" in sender:
+                return sender["id"]
+            chat = payload.get("chat")
+            if isinstance(chat, dict) and "id" in chat:
+                return chat["id"]
+    return update.get("update_id", 0)
+
+
+def shard_for(update, workers):
+    return update_user_id(update) % workers
+
+
+# Синтетические обновления для проверки шардирования на одной машине
+def fake_updates(count, users=100, texts=("/start", "🔎 Википедия", "Python", "📜 История")):
+    for update_id in range(1, count + 1):
+        user_id = 1000 + update_id % users
+        yield {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                "text": texts[update_id % len(texts)],
+            },
+        }
+
+
+# Цикл воркера: забирает обновления из своей очереди и обрабатывает их
+# конкурентно, но обновления одного пользователя - строго по очереди,
+# чтобы не нарушить порядок переходов FSM. None в очереди - сигнал остановки.
+async def process_shard(updates, feed, heartbeats=None, index=0):
+    loop = asyncio.get_running_loop()
+    chains = {}
+
+    async def beat():
+        while True:
+            heartbeats[index] = time.time()
+            await asyncio.sleep(1)
+
+    async def chain(previous, update):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            await feed(update)
+        except Exception as e:
+            logger.error(f"Воркер {index}: ошибка обработки обновления {update.get('update_id')}: {e}")
+
+    def forget(key, task):
+        if chains.get(key) is task:
+            del chains[key]
+
+    beat_task = asyncio.create_task(beat()) if heartbeats is not None else None
+    try:
+        while True:
+            update = await loop.run_in_executor(None, updates.get)
+            if update is None:
+                break
+            key = update_user_id(update)
+            task = asyncio.create_task(chain(chains.get(key), update))
+            chains[key] = task
+            task.add_done_callback(lambda done, key=key: forget(key, done))
+        await asyncio.gather(*chains.values(), return_exceptions=True)
+    finally:
+        if beat_task is not None:
+            beat_task.cancel()
+
+
+# Фронтовой процесс: раздаёт обновления N воркерам по хешу user_id,
+# следит за их здоровьем (процесс жив и цикл событий отвечает) и перезапускает
+# упавшие или зависшие воркеры. Очередь воркера живёт в родительском
+# процессе, поэтому обновления, пришедшие во время перезапуска, не теряются.
+# target(index, updates, heartbeats) - функция воркера, должна импортироваться из модуля.
+class ShardedRunner:
+    def __init__(self, target, workers, queue_size=10000, health_interval=5.0, heartbeat_timeout=30.0,
+                 startup_timeout=120.0):
+        self.target = target
+        self.workers = workers
+        self.health_interval = health_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [self._ctx.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.heartbeats = self._ctx.Array("d", workers)
+        self.processes = [None] * workers
+        self.restarts = 0
+        self.dispatched = 0
+        self._monitor = None
+
+    def _spawn(self, index):
+        # Первый отклик ждём дольше: воркеру нужно импортировать модули и открыть базу
+        self.heartbeats[index] = time.time() + self.startup_timeout
+        process = self._ctx.Process(target=self.target, args=(index, self.queues[index], self.heartbeats),
+                                    name=f"bot-worker-{index}", daemon=True)
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Запущен воркер {index} (pid {process.pid})")
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        self._monitor = asyncio.create_task(self._watch())
+
+    async def dispatch(self, update):
+        updates = self.queues[shard_for(update, self.workers)]
+        try:
+            updates.put_nowait(update)
+        except queue.Full:
+            # Воркер не успевает - ждём места, не блокируя цикл событий
+            await asyncio.to_thread(updates.put, update)
+        self.dispatched += 1
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            now = time.time()
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, перезапускаем")
+                elif now - self.heartbeats[index] > self.heartbeat_timeout:
+                    logger.error(f"Воркер {index} не отвечает {now - self.heartbeats[index]:.0f} с, перезапускаем")
+                    process.kill()
+                    await asyncio.to_thread(process.join, 5)
+                else:
+                    continue
+                self.restarts += 1
+                self._spawn(index)
+
+    async def stop(self, timeout=30.0):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        for updates in self.queues:
+            await asyncio.to_thread(updates.put, None)
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self.processes):
+            await asyncio.to_thread(process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                # SIGTERM воркер игнорирует, поэтому только kill
+                logger.warning(f"Воркер {index} не остановился за {timeout} с, завершаем принудительно")
+                process.kill()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "alive": sum(process is not None and process.is_alive() for process in self.processes),
+            "restarts": self.restarts,
+            "dispatched": self.dispatched,
+            "queue_depths": [self._qsize(updates) for updates in self.queues],
+        }
+
+    @staticmethod
+    def _qsize(updates):
+        try:
+            return updates.qsize()
+        except NotImplementedError:
+            return None
+
+
+# Получение обновлений long polling'ом во фронтовом процессе (без их обработки)
+async def poll_updates(bot, feed, allowed_updates=None, timeout=30):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    offset = None
+    while not stop.is_set():
+        request = asyncio.ensure_future(bot.get_updates(offset=offset, timeout=timeout,
+                                                        allowed_updates=allowed_updates))
+        stopping = asyncio.ensure_future(stop.wait())
+        await asyncio.wait({request, stopping}, return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
+        if not request.done():
+            request.cancel()
+            break
+        try:
+            updates = request.result()
+        except Exception as e:
+            logger.error(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            await feed(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+            offset = update.update_id + 1
@@ -0,0 +1,94 @@
+import builtins
+import json
+import logging
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+
+# Отчёт о запуске процесса: время импорта каждого пакета верхнего уровня
+# (включая пакеты, которые он импортирует сам), этапы запуска и время до
+# первого обработанного обновления. Отсчёт - от импорта этого модуля,
+# поэтому main.py импортирует его первым.
+# Экземпляр подключается outer-middleware диспетчера, чтобы поймать первое обновление.
+class StartupReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.imports = {}
+        self.phases = {}
+        self.extra = {}
+        self.path = None
+        self._original_import = None
+        self._first_update = False
+
+    def _elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 1)
+
+    # Замер импортов через builtins.__import__: первый импорт каждого пакета верхнего уровня
+    def track_imports(self):
+        if self._original_import is not None:
+            return
+        original = self._original_import = builtins.__import__
+        imports = self.imports
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            top = name.partition(".")[0]
+            if level or top in sys.modules or top in imports:
+                return original(name, globals, locals, fromlist, level)
+            imports[top] = None
+            started = time.perf_counter()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                imports[top] = round((time.perf_counter() - started) * 1000, 1)
+
+        builtins.__import__ = timed_import
+
+    def stop_tracking_imports(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    # Этап запуска: время от начала отсчёта (мс)
+    def mark(self, phase):
+        if phase == "imports":
+            self.stop_tracking_imports()
+        self.phases.setdefault(phase, self._elapsed_ms())
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            if not self._first_update:
+                self._first_update = True
+                self.mark("first_update")
+                self.write()
+
+    def report(self):
+        return {
+            "phases_ms": dict(self.phases),
+            "imports_ms": dict(sorted(((name, ms) for name, ms in self.imports.items() if ms is not None),
+                                      key=lambda item: -item[1])),
+            **self.extra,
+        }
+
+    # Журнал и, если задан path, JSON-файл для сравнения между релизами
+    def write(self):
+        report = self.report()
+        slowest = ", ".join(f"{name}={ms}" for name, ms in list(report["imports_ms"].items())[:5])
+        logger.info(f"Запуск: этапы {report['phases_ms']} мс, самые долгие импорты (мс): {slowest}")
+        if self.path:
+            try:
+                with open(self.path, "w", encoding="utf-8") as f:
+                    json.dump(report, f, ensure_ascii=False, indent=2)
+            except OSError as e:
+                logger.warning(f"Не удалось записать отчёт о запуске в {self.path}: {e}")
+
+    def stats(self):
+        stats = {f"{phase}_ms": ms for phase, ms in self.phases.items()}
+        stats.update(self.extra)
+        return stats
+
+
+STARTUP = StartupReport()
@@ -0,0 +1,116 @@
+import copy
+import json
+import time
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+from cache import TTLCache
+
+MISSING = object()
+
+
+def _state_name(state):
+    return state.state if isinstance(state, State) else state
+
+
+def _storage_key(key):
+    return (f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:"
+            f"{key.business_connection_id or ''}:{key.destiny}")
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+# FSM-хранилище в общей базе SQLite (таблица fsm_state).
+# Одна строка на (бот, чат, пользователь): имя состояния и данные в компактном JSON.
+# Каждая запись продлевает срок жизни строки на state_ttl секунд; брошенные
+# состояния не читаются после истечения срока и периодически удаляются.
+class SQLiteStorage(BaseStorage):
+    def __init__(self, db, state_ttl=24 * 3600, purge_interval=600):
+        self.db = db
+        self.state_ttl = state_ttl
+        self.purge_interval = purge_interval
+        self._last_purge = time.time()
+
+    async def set_state(self, key, state=None):
+        await self.db.transaction(self._write, _storage_key(key), "state", _state_name(state))
+
+    async def set_data(self, key, data):
+        await self.db.transaction(self._write, _storage_key(key), "data", _dumps(dict(data)) if data else None)
+
+    def _write(self, conn, key, column, value):
+        now = time.time()
+        conn.execute(f'''INSERT INTO fsm_state (key, {column}, expires_at) VALUES (?, ?, ?)
+                         ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column},
+                                                        expires_at = excluded.expires_at''',
+                     (key, value, now + self.state_ttl))
+        # Пустая строка (нет ни состояния, ни данных) не нужна
+        conn.execute('DELETE FROM fsm_state WHERE key = ? AND state IS NULL AND data IS NULL', (key,))
+        if now - self._last_purge > self.purge_interval:
+            self._last_purge = now
+            conn.execute('DELETE FROM fsm_state WHERE expires_at < ?', (now,))
+
+    async def _read(self, key, column):
+        row = await self.db.fetchone(f'SELECT {column} FROM fsm_state WHERE key = ? AND expires_at > ?',
+                                     (_storage_key(key), time.time()))
+        return row[0] if row else None
+
+    async def get_state(self, key):
+        return await self._read(key, "state")
+
+    async def get_data(self, key):
+        data = await self._read(key, "data")
+        return json.loads(data) if data else {}
+
+    async def close(self):
+        pass
+
+
+# Кэш чтения поверх любого FSM-хранилища: запись сквозная, чтение из памяти.
+# Кэш согласован, пока все обновления одного пользователя обрабатывает один
+# процесс (один процесс бота или шардирование по user_id).
+class CachedStorage(BaseStorage):
+    def __init__(self, backend, maxsize=10000, ttl=60.0):
+        self.backend = backend
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def set_state(self, key, state=None):
+        await self.backend.set_state(key, state)
+        self.cache.set(("state", key), _state_name(state))
+
+    async def get_state(self, key):
+        state = self.cache.get(("state", key), MISSING)
+        if state is MISSING:
+            state = await self.backend.get_state(key)
+            self.cache.set(("state", key), state)
+        return state
+
+    async def set_data(self, key, data):
+        data = copy.deepcopy(dict(data))
+        await self.backend.set_data(key, data)
+        self.cache.set(("data", key), data)
+
+    async def get_data(self, key):
+        data = self.cache.get(("data", key), MISSING)
+        if data is MISSING:
+            data = await self.backend.get_data(key)
+            self.cache.set(("data", key), data)
+        return copy.deepcopy(data)
+
+    async def close(self):
+        await self.backend.close()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+# Redis (или совместимый сервер) как общее хранилище для нескольких процессов.
+# Пакет redis - необязательная зависимость, импортируется только в этом режиме.
+def create_redis_storage(url, state_ttl):
+    try:
+        from aiogram.fsm.storage.redis import RedisStorage
+    except ImportError as e:
+        raise RuntimeError("Для FSM_STORAGE=redis установите пакет redis: pip install redis") from e
+    return RedisStorage.from_url(url, state_ttl=state_ttl, data_ttl=state_ttl)
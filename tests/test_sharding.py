@@ -0,0 +1,36 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sharding import shard_for, update_user_id  # noqa: E402
+
+
+def chat_member_update(kind, admin_id, member_id):
+    user = {"id": member_id, "is_bot": False, "first_name": "member"}
+    return {
+        "update_id": 1,
+        kind: {
+            "chat": {"id": -1001, "type": "channel"},
+            "from": {"id": admin_id, "is_bot": False, "first_name": "admin"},
+            "date": 0,
+            "old_chat_member": {"status": "member", "user": user},
+            "new_chat_member": {"status": "kicked", "user": user, "until_date": 0},
+        },
+    }
+
+
+# Изменение статуса участника уходит в шард участника, а не администратора
+def test_chat_member_routed_by_member():
+    workers = 4
+    admin_id, member_id = 1000, 1001
+    for kind in ("chat_member", "my_chat_member"):
+        update = chat_member_update(kind, admin_id, member_id)
+        assert update_user_id(update) == member_id
+        assert shard_for(update, workers) == member_id % workers
+        assert shard_for(update, workers) != admin_id % workers
+
+
+def test_message_routed_by_sender():
+    update = {"update_id": 7, "message": {"chat": {"id": -5}, "from": {"id": 42}}}
+    assert update_user_id(update) == 42
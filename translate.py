@@ -0,0 +1,106 @@
+import asyncio
+import inspect
+from collections import defaultdict
+
+from cache import TTLCache, SingleFlight
+from metrics import timed
+from resilience import Upstream
+
+
+def normalize_text(text):
+    return " ".join(text.split())
+
+
+# Адаптер googletrans: в 3.x translate() синхронный, в 4.x - корутина.
+# Синхронный вариант уходит в пул потоков, чтобы не блокировать цикл событий.
+# Ленивый клиент (LazyClient) до первого вызова создаётся там же: импорт
+# googletrans занимает сотни миллисекунд.
+class GoogleTranslateBackend:
+    def __init__(self, translator):
+        self.translator = translator
+
+    async def translate(self, texts, src, dest):
+        warm = getattr(self.translator, "warm", None)
+        if warm is not None:
+            await warm()
+        if inspect.iscoroutinefunction(self.translator.translate):
+            results = await self.translator.translate(texts, src=src, dest=dest)
+        else:
+            results = await asyncio.to_thread(self.translator.translate, texts, src=src, dest=dest)
+        if not isinstance(results, list):
+            results = [results]
+        return [result.text for result in results]
+
+
+# Сервис перевода: кэш по (нормализованный текст, src, dest), объединение
+# одинаковых запросов, микропакеты из запросов, пришедших в течение
+# batch_window секунд, и ограничение числа одновременных вызовов бэкенда.
+# Бэкенд - любой объект с корутиной translate(texts, src, dest) -> list[str],
+# вызовы идут через upstream (срок, выключатель, дублирование).
+class TranslationService:
+    def __init__(self, backend, concurrency=4, cache_size=10000, ttl=24 * 3600, batch_window=0.02, max_batch=20,
+                 upstream=None):
+        self.backend = backend
+        self.upstream = upstream or Upstream("googletrans")
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self.flight = SingleFlight()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending = defaultdict(list)
+        self._timers = {}
+        self.batches = 0
+        self.texts_sent = 0
+
+    async def translate(self, text, src="auto", dest="en"):
+        key = (normalize_text(text), src, dest)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        return await self.flight.run(key, self._translate, key)
+
+    async def _translate(self, key):
+        text, src, dest = key
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending[(src, dest)]
+        batch.append((text, future))
+        if len(batch) >= self.max_batch:
+            self._flush((src, dest))
+        elif (src, dest) not in self._timers:
+            self._timers[(src, dest)] = asyncio.get_running_loop().call_later(
+                self.batch_window, self._flush, (src, dest))
+        result = await future
+        self.cache.set(key, result)
+        return result
+
+    def _flush(self, pair):
+        timer = self._timers.pop(pair, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(pair, None)
+        if batch:
+            asyncio.ensure_future(self._send(pair, batch))
+
+    async def _send(self, pair, batch):
+        src, dest = pair
+        async with self._semaphore:
+            self.batches += 1
+            self.texts_sent += len(batch)
+            try:
+                with timed("external.googletrans"):
+                    results = await self.upstream.call(self.backend.translate, [text for text, _ in batch], src, dest)
+                if len(results) != len(batch):
+                    raise RuntimeError("Бэкенд перевода вернул неверное число результатов")
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats.update(batches=self.batches, texts_sent=self.texts_sent, coalesced=self.flight.coalesced)
+        return stats
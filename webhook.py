@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import secrets
+import signal
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+logger = logging.getLogger(__name__)
+
+
+# Счётчик обновлений, которые сейчас обрабатываются (outer-middleware диспетчера).
+# Нужен, чтобы при остановке дождаться уже принятых обновлений.
+class InFlightTracker:
+    def __init__(self):
+        self.count = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.count += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.count -= 1
+            if self.count == 0:
+                self._idle.set()
+
+    async def wait_idle(self, timeout):
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+# Приём обновлений через вебхук: aiohttp-сервер проверяет секретный токен
+# (заголовок X-Telegram-Bot-Api-Secret-Token) и передаёт обновления в dp.
+# Без секрета вебхук не запускается: иначе любой, кто узнал адрес, может прислать
+# поддельные обновления (в том числе от имени администратора).
+# GET /health отвечает 200, пока инстанс принимает обновления, и 503 во время остановки.
+# По SIGINT/SIGTERM /health сначала drain_grace секунд отвечает 503, чтобы балансировщик
+# успел убрать инстанс, затем сервер перестаёт принимать соединения, ждёт завершения
+# обработчиков (не дольше drain_timeout) и только потом закрывает сессию бота.
+# Если передан feed, обновления не обрабатываются здесь, а сырыми dict
+# передаются в feed(update) (фронтовой процесс шардированного режима).
+async def run_webhook(dp, bot, *, url, path, secret, host, port, allowed_updates=None, drain_timeout=30.0,
+                      feed=None, drain_grace=5.0):
+    if not secret:
+        raise ValueError("Для режима webhook нужен WEBHOOK_SECRET")
+    tracker = InFlightTracker()
+    dp.update.outer_middleware(tracker)
+    draining = False
+
+    async def forward(request):
+        token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not secrets.compare_digest(token, secret):
+            return web.Response(status=401, text="Unauthorized")
+        await feed(await request.json())
+        return web.json_response({})
+
+    async def health(request):
+        status = 503 if draining else 200
+        return web.json_response({"status": "draining" if draining else "ok", "in_flight": tracker.count},
+                                 status=status)
+
+    app = web.Application()
+    if feed is None:
+        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=path)
+    else:
+        app.router.add_post(path, forward)
+    app.router.add_get("/health", health)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"Вебхук слушает {host}:{port}{path}")
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    if url:
+        # Несколько инстансов за балансировщиком регистрируют один и тот же адрес
+        await bot.set_webhook(url + path, secret_token=secret, allowed_updates=allowed_updates)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    try:
+        await stop.wait()
+    finally:
+        draining = True
+        logger.info(f"Остановка вебхука, обрабатывается обновлений: {tracker.count}")
+        # Пока балансировщик видит 503, обновления ещё принимаются
+        await asyncio.sleep(drain_grace)
+        await site.stop()
+        if not await tracker.wait_idle(drain_timeout):
+            logger.warning(f"Не дождались {tracker.count} обработчиков за {drain_timeout} с")
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await runner.cleanup()
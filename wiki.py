@@ -0,0 +1,143 @@
+import asyncio
+import html
+import re
+import time
+
+from cache import TTLCache, SingleFlight
+from metrics import timed
+from resilience import Upstream
+
+MISSING = object()
+TAG_RE = re.compile(r"<[^>]+>")
+
+
+# Ключ кэша: регистр и лишние пробелы не важны
+def normalize_title(title):
+    return " ".join(title.split()).casefold()
+
+
+# Фрагмент из выдачи поиска приходит с HTML-разметкой совпадений
+def plain_snippet(snippet):
+    return " ".join(html.unescape(TAG_RE.sub("", snippet or "")).split())
+
+
+# Поиск статей Википедии вне цикла событий с двухуровневым кэшем:
+# LRU в памяти и таблица wiki_cache в SQLite, которая переживает перезапуск.
+# "Не найдено" тоже кэшируется (summary = NULL), но на меньший срок.
+# Поиск для inline-режима кэширует готовые результаты по нормализованному запросу.
+# Запросы к Википедии идут через upstream (срок, выключатель, дублирование);
+# если она недоступна, отдаётся просроченная статья из SQLite, если есть.
+class WikiService:
+    def __init__(self, client, db, memory_size=5000, ttl=7 * 24 * 3600, not_found_ttl=3600, max_length=4000,
+                 search_limit=5, search_summaries=2, search_cache_size=20000, search_ttl=3600, upstream=None):
+        self.client = client
+        self.db = db
+        self.upstream = upstream or Upstream("wikipedia")
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self.max_length = max_length
+        self.memory = TTLCache(maxsize=memory_size, ttl=ttl)
+        self.flight = SingleFlight()
+        self.search_limit = search_limit
+        self.search_summaries = search_summaries
+        self.search_ttl = search_ttl
+        self.search_cache = TTLCache(maxsize=search_cache_size, ttl=search_ttl)
+        self.search_flight = SingleFlight()
+        self.disk_hits = 0
+        self.stale_hits = 0
+        self.fetches = 0
+        self.searches = 0
+
+    # Возвращает краткое содержание статьи или None, если статьи нет
+    async def summary(self, title):
+        key = normalize_title(title)
+        if not key:
+            return None
+        cached = self.memory.get(key, MISSING)
+        if cached is not MISSING:
+            return cached
+        return await self.flight.run(key, self._load, key, title)
+
+    async def _load(self, key, title):
+        row = await self.db.fetchone('SELECT summary, fetched_at FROM wiki_cache WHERE title_key = ?', (key,))
+        stale = None
+        if row is not None:
+            summary, fetched_at = row
+            remaining = fetched_at + self._ttl_for(summary) - time.time()
+            if remaining > 0:
+                self.disk_hits += 1
+                self.memory.set(key, summary, ttl=remaining)
+                return summary
+            stale = summary
+
+        self.fetches += 1
+        try:
+            with timed("external.wikipedia"):
+                summary = await self.upstream.call(asyncio.to_thread, self._fetch, title)
+        except Exception:
+            if stale is None:
+                raise
+            self.stale_hits += 1
+            return stale
+        await self.db.execute('INSERT OR REPLACE INTO wiki_cache (title_key, summary, fetched_at) VALUES (?, ?, ?)',
+                              (key, summary, time.time()))
+        self.memory.set(key, summary, ttl=self._ttl_for(summary))
+        return summary
+
+    def _ttl_for(self, summary):
+        return self.ttl if summary is not None else self.not_found_ttl
+
+    # Синхронные HTTP-запросы wikipediaapi, выполняются в пуле потоков
+    def _fetch(self, title):
+        page = self.client.page(title)
+        if not page.exists():
+            return None
+        return page.summary[:self.max_length]
+
+    # Результаты поиска из кэша без обращения к Википедии или None
+    def cached_search(self, query):
+        return self.search_cache.get(normalize_title(query))
+
+    # Поиск статей: список (название, фрагмент, краткое содержание) до search_limit штук.
+    # Повтор того же запроса (в том числе другим пользователем) не идёт в Википедию,
+    # а краткие содержания берутся из общего кэша summary(). Загружаются они только для
+    # первых search_summaries статей, у остальных краткое содержание есть, лишь если
+    # уже лежит в памяти, иначе None.
+    async def search(self, query):
+        key = normalize_title(query)
+        if not key:
+            return []
+        cached = self.search_cache.get(key, MISSING)
+        if cached is not MISSING:
+            return cached
+        return await self.search_flight.run(key, self._search, key, query)
+
+    async def _search(self, key, query):
+        self.searches += 1
+        with timed("external.wikipedia_search"):
+            found = await self.upstream.call(asyncio.to_thread, self._fetch_search, query)
+        head, tail = found[:self.search_summaries], found[self.search_summaries:]
+        summaries = await asyncio.gather(*(self.summary(title) for title, _ in head), return_exceptions=True)
+        results = [(title, snippet, summary)
+                   for (title, snippet), summary in zip(head, summaries) if isinstance(summary, str)]
+        results += [(title, snippet, self.memory.get(normalize_title(title))) for title, snippet in tail]
+        # Неполный ответ (часть статей не загрузилась) не кэшируем
+        if not any(isinstance(summary, Exception) for summary in summaries):
+            self.search_cache.set(key, results, ttl=self.search_ttl if results else self.not_found_ttl)
+        return results
+
+    def _fetch_search(self, query):
+        found = self.client.search(query, limit=self.search_limit)
+        return [(page.title, plain_snippet(page.search_meta.snippet if page.search_meta else ""))
+                for page in found.pages.values()]
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats.update(disk_hits=self.disk_hits, stale_hits=self.stale_hits, fetches=self.fetches,
+                     coalesced=self.flight.coalesced)
+        return stats
+
+    def search_stats(self):
+        stats = self.search_cache.stats()
+        stats.update(searches=self.searches, coalesced=self.search_flight.coalesced)
+        return stats